@@ -0,0 +1,130 @@
+"""
+ConPlc - connect PLC and PC
+Copyright (C) 2021  Marvin Mangold (Marvin.Mangold00@googlemail.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from operator import itemgetter
+
+# values of the window saved with every row (besides the count of frames of the window)
+functions = ["min", "max", "mean", "last"]
+
+# datatypes with values that can be compared and added (all other columns save the last value)
+numerics = ("Bool", "SInt", "USInt", "Int", "UInt", "DInt", "UDInt", "LInt", "ULInt", "Real", "LReal")
+
+
+def get_mean(value):
+    """
+    text of a mean value
+    """
+    return str(float(value))
+
+
+class Window(object):
+    def __init__(self):
+        """
+        aggregate the values of every received frame between two saved rows (window)
+        min, max, sum and last of every numeric column and the count of frames (constant memory)
+        the row of the window is saved like set in functions, the window starts again after every row
+        """
+        self.functions = []
+        self.numeric = lambda values: ()  # takes the values of the numeric columns
+        self.numerics = []  # position of the numeric columns in the row (None = last value only)
+        self.formats = []
+        self.count = 0
+        self.mins = []
+        self.maxs = []
+        self.sums = []
+
+    def compile(self, texts, indexes, formats, datatypes, selection):
+        """
+        compile the columns of the window and return the header of the row
+        texts, indexes, formats and datatypes of the columns
+        selection: values of the window saved for every numeric column ("min", "max", "mean", "last")
+        """
+        self.functions = [function for function in functions if function in selection]
+        columns = [index for index, datatype in zip(indexes, datatypes) if datatype in numerics]
+        if len(columns) == 0:
+            self.numeric = lambda values: ()
+        elif len(columns) == 1:
+            index = columns[0]
+            self.numeric = lambda values: (values[index],)
+        else:
+            self.numeric = itemgetter(*columns)
+        self.numerics = []
+        self.formats = formats
+        header = ["Count"]
+        position = 0
+        for text, datatype in zip(texts, datatypes):
+            if datatype in numerics:
+                self.numerics.append(position)
+                position += 1
+                header.extend("{text} {function}".format(text=text, function=function)
+                              for function in self.functions)
+            else:
+                self.numerics.append(None)
+                header.append(text)
+        self.reset()
+        return header
+
+    def reset(self):
+        """
+        start a new window
+        """
+        self.count = 0
+        self.mins = []
+        self.maxs = []
+        self.sums = []
+
+    def add(self, values):
+        """
+        add the decoded values of a frame to the window
+        """
+        numeric = self.numeric(values)
+        if self.count == 0:
+            self.mins = list(numeric)
+            self.maxs = list(numeric)
+            self.sums = list(numeric)
+        else:
+            self.mins = [value if value < low else low for value, low in zip(numeric, self.mins)]
+            self.maxs = [value if value > high else high for value, high in zip(numeric, self.maxs)]
+            self.sums = [value + total for value, total in zip(numeric, self.sums)]
+        self.count += 1
+
+    def row(self, columns):
+        """
+        texts of the row of the window and start a new window
+        columns: last values of the columns
+        """
+        data = [str(self.count)]
+        for position, text, value in zip(self.numerics, self.formats, columns):
+            if position is None:
+                data.append(text(value) if value is not None else "")
+                continue
+            if self.count == 0:
+                # no frame in the window
+                data.extend("" for function in self.functions)
+                continue
+            for function in self.functions:
+                if function == "min":
+                    data.append(text(self.mins[position]))
+                elif function == "max":
+                    data.append(text(self.maxs[position]))
+                elif function == "mean":
+                    data.append(get_mean(self.sums[position] / self.count))
+                else:
+                    data.append(text(value) if value is not None else "")
+        self.reset()
+        return data
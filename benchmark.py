@@ -0,0 +1,276 @@
+"""
+ConPlc - connect PLC and PC
+Copyright (C) 2021  Marvin Mangold (Marvin.Mangold00@googlemail.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import os
+import sys
+import time
+import types
+import struct
+import random
+import subprocess
+import readplc
+
+
+def get_entry(name, datatype, byte, size):
+    """
+    create entry of the datastructure like readudt does
+    """
+    return {"name": name,
+            "datatype": datatype,
+            "byte": "{byte}.0".format(byte=byte),
+            "comment": "",
+            "visible": True,
+            "access": True,
+            "action": None,
+            "value": "",
+            "size": size}
+
+
+def get_structure_strings(count=50, length=254):
+    """
+    create datastructure with count String[length] and count WString[length]
+    return datastructure and datasize
+    """
+    datastructure = []
+    address = 0
+    for number in range(count):
+        size = 2 + length
+        datastructure.append(get_entry("string_{number}".format(number=number),
+                                       "String[{length}]".format(length=length), address, size))
+        address += size + size % 2
+        size = 4 + length * 2
+        datastructure.append(get_entry("wstring_{number}".format(number=number),
+                                       "WString[{length}]".format(length=length), address, size))
+        address += size
+    return datastructure, address
+
+
+def get_structure_bools(count=4096):
+    """
+    create datastructure with one Array[0..count-1] of Bool
+    return datastructure and datasize
+    """
+    datastructure = []
+    for number in range(count):
+        element = get_entry("alarms.[{number}]".format(number=number), "Bool", number // 8, 0.125)
+        element["byte"] = "{byte}.{bit}".format(byte=number // 8, bit=number % 8)
+        datastructure.append(element)
+    return datastructure, (count + 7) // 8
+
+
+def get_structure_axes(count=1000):
+    """
+    create datastructure with one Array[0..count-1] of "Axis" like readudt does
+    "Axis": 8 x Bool, Mode Byte, Speed Int, Position Real, Torque Real (12 bytes without gaps)
+    return datastructure and datasize
+    """
+    marker = get_entry("", "START_ARRAY", 0, 0)
+    array = get_entry("axes", 'Array[0..{last}] of "Axis"'.format(last=count - 1), 0, 0)
+    array["action"] = "open"
+    datastructure = [marker, array, get_entry("", "START_DIMENSION", 0, 0)]
+    for number in range(count):
+        address = number * 12
+        name = "axes.[{number}]".format(number=number)
+        item = get_entry(name, '"Axis"', address, 0)
+        item["action"] = "open"
+        datastructure.extend([get_entry("", "START_UDT", address, 0), item])
+        fields = ("Enabled", "Fault", "Ready", "Homed", "Moving", "LimitPos", "LimitNeg", "Warning")
+        for bit, field in enumerate(fields):
+            element = get_entry("{name}.{field}".format(name=name, field=field), "Bool", address, 0.125)
+            element["byte"] = "{byte}.{bit}".format(byte=address, bit=bit)
+            datastructure.append(element)
+        datastructure.append(get_entry("{name}.Mode".format(name=name), "Byte", address + 1, 1))
+        datastructure.append(get_entry("{name}.Speed".format(name=name), "Int", address + 2, 2))
+        datastructure.append(get_entry("{name}.Position".format(name=name), "Real", address + 4, 4))
+        datastructure.append(get_entry("{name}.Torque".format(name=name), "Real", address + 8, 4))
+        datastructure.append(get_entry("", "END_UDT", address + 12, 0))
+    datastructure.append(get_entry("", "END_DIMENSION", count * 12, 0))
+    datastructure.append(get_entry("", "END_ARRAY", count * 12, 0))
+    return datastructure, count * 12
+
+
+def get_frame_strings(datastructure, datasize):
+    """
+    create random frame for a datastructure of strings
+    every string is filled to a random length
+    """
+    frame = bytearray(datasize)
+    for element in datastructure:
+        byte = int(element["byte"].split(".")[0])
+        length = int(element["datatype"].split("[")[1][:-1])
+        actual = random.randint(0, length)
+        if element["datatype"][:6] == "String":
+            frame[byte:byte + 2] = bytes([length, actual])
+            frame[byte + 2:byte + 2 + actual] = bytes(random.randint(32, 126) for char in range(actual))
+        else:
+            frame[byte:byte + 4] = struct.pack(">HH", length, actual)
+            text = "".join(chr(random.randint(32, 0x24F)) for char in range(actual))
+            frame[byte + 4:byte + 4 + actual * 2] = text.encode("utf-16-be")
+    return bytes(frame)
+
+
+def get_baseline(revision=None):
+    """
+    load readplc.py of a git revision as module "baseline"
+    without revision the first commit of the repository is loaded (decoder before the compiled decoder)
+    """
+    path = os.path.dirname(os.path.abspath(__file__))
+    if revision is None:
+        revision = subprocess.check_output(["git", "rev-list", "--max-parents=0", "HEAD"], cwd=path,
+                                           universal_newlines=True).split()[-1]
+    source = subprocess.check_output(["git", "show", "{revision}:readplc.py".format(revision=revision)], cwd=path)
+    baseline = types.ModuleType("baseline")
+    exec(compile(source, "baseline/readplc.py", "exec"), baseline.__dict__)
+    return baseline
+
+
+def baseline_decode(baseline, datastructure):
+    """
+    return function that decodes a frame like conplc did with the baseline decoder
+    the received bytestring is converted to a list of integer, the text values are saved in the datastructure
+    """
+    def decode(frame):
+        baseline.get_plc_data(receivedbytes=list(frame), datastructure=datastructure)
+    return decode
+
+
+def check(datastructure, *decoders):
+    """
+    check that the decoders read the same text as the baseline decoder (saved in the datastructure)
+    """
+    for index, element in enumerate(datastructure):
+        if index not in decoders[0].table:
+            continue
+        for decoder in decoders:
+            if decoder.text(index) != element["value"]:
+                raise ValueError("Benchmark: decoders read different values for {name}: {a!r} != {b!r}".format(
+                    name=element["name"], a=decoder.text(index), b=element["value"]))
+
+
+def measure(function, frames, repeat=3):
+    """
+    call function for every frame and return the best time per frame in microseconds
+    """
+    best = None
+    for run in range(repeat):
+        start = time.perf_counter()
+        for frame in frames:
+            function(frame)
+        duration = (time.perf_counter() - start) / len(frames) * 1000000
+        if best is None or duration < best:
+            best = duration
+    return best
+
+
+def report(title, results):
+    """
+    print the time per frame and the factor to the baseline decoder
+    """
+    print(title)
+    for name, duration in results.items():
+        print("  {name:<10} {duration:>12.1f} us/frame  {factor:>8.1f}x".format(
+            name=name, duration=duration, factor=results["baseline"] / duration))
+
+
+def benchmark_strings(baseline, count=50, length=254, numframes=20):
+    """
+    compare string decoding of the baseline decoder and readplc.Decoder
+    """
+    datastructure, datasize = get_structure_strings(count=count, length=length)
+    frames = [get_frame_strings(datastructure, datasize) for frame in range(numframes)]
+    decoder = readplc.Decoder(datastructure)
+    legacy = baseline_decode(baseline, datastructure)
+    legacy(frames[0])
+    decoder.decode(frames[0])
+    check(datastructure, decoder)
+    results = {"baseline": measure(legacy, frames),
+               "decoder": measure(decoder.decode, frames)}
+    report("Strings: {count} x String[{length}] + {count} x WString[{length}], {size} bytes per frame".format(
+        count=count, length=length, size=datasize), results)
+    return results
+
+
+def benchmark_bools(baseline, count=4096, numframes=20):
+    """
+    compare bool decoding of the baseline decoder, readplc.Decoder with one field per byte and with bitfields
+    """
+    datastructure, datasize = get_structure_bools(count=count)
+    frames = [bytes(random.getrandbits(8) for byte in range(datasize)) for frame in range(numframes)]
+    minsize = readplc.bitfield_minsize
+    readplc.bitfield_minsize = count + 1
+    decoder_single = readplc.Decoder(datastructure)
+    readplc.bitfield_minsize = minsize
+    decoder_bitfield = readplc.Decoder(datastructure)
+    legacy = baseline_decode(baseline, datastructure)
+    legacy(frames[0])
+    decoder_single.decode(frames[0])
+    decoder_bitfield.decode(frames[0])
+    check(datastructure, decoder_single, decoder_bitfield)
+    results = {"baseline": measure(legacy, frames),
+               "single": measure(decoder_single.decode, frames),
+               "bitfield": measure(decoder_bitfield.decode, frames)}
+    report("Bools: Array[0..{last}] of Bool, {size} bytes per frame".format(last=count - 1, size=datasize), results)
+    return results
+
+
+def benchmark_axes(baseline, count=1000, numframes=20, changes=10):
+    """
+    compare decoding of an array of UDT of the baseline decoder, readplc.Decoder element by element, as table
+    and as delta (update) when only some axes change from frame to frame
+    """
+    datastructure, datasize = get_structure_axes(count=count)
+    frames = [struct.pack(">" + "BBhff" * count,
+                          *[value for axis in range(count) for value in (random.getrandbits(8), random.getrandbits(8),
+                            random.randint(-32768, 32767), random.random(), random.random())])
+              for frame in range(numframes)]
+    # frames of a running machine: only some axes change from frame to frame
+    moving = [frames[0]]
+    for frame in range(numframes - 1):
+        data = bytearray(moving[-1])
+        for axis in random.sample(range(count), changes):
+            struct.pack_into(">f", data, axis * 12 + 4, random.random())
+        moving.append(bytes(data))
+    minsize = readplc.structarray_minsize
+    readplc.structarray_minsize = count + 1
+    decoder_single = readplc.Decoder(datastructure)
+    readplc.structarray_minsize = minsize
+    decoder_table = readplc.Decoder(datastructure)
+    decoder_delta = readplc.Decoder(datastructure)
+    legacy = baseline_decode(baseline, datastructure)
+    legacy(moving[-1])
+    decoder_single.decode(moving[-1])
+    decoder_table.decode(moving[-1])
+    for frame in moving:
+        decoder_delta.update(frame)
+    check(datastructure, decoder_single, decoder_table, decoder_delta)
+    results = {"baseline": measure(legacy, moving),
+               "single": measure(decoder_single.decode, moving),
+               "table": measure(decoder_table.decode, moving),
+               "delta": measure(decoder_delta.update, moving)}
+    report('Axes: Array[0..{last}] of "Axis", {size} bytes per frame, {changes} axes change per frame'.format(
+        last=count - 1, size=datasize, changes=changes), results)
+    return results
+
+
+if __name__ == '__main__':
+    # optional argument: git revision of the baseline decoder
+    baseline = get_baseline(sys.argv[1] if len(sys.argv) > 1 else None)
+    benchmark_strings(baseline)
+    benchmark_bools(baseline)
+    benchmark_axes(baseline)
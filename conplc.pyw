@@ -18,9 +18,9 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import view
 import readudt
-import readplc
 import tcpserver
-import csvhandler
+import station
+import pipeline
 import json
 import time
 import queue
@@ -44,14 +44,24 @@ class Controller(object):
         with open("default.cplc") as projectfile:
             self.projectfile = json.load(projectfile)
 
+        # processing of the main project (decoder and csv handler)
+        self.main = station.Station(name="", projectfile=self.projectfile)
+        # last state of the main project taken from the processing thread
+        self.snapshot = None
+        # call pipeline (processes the received data in its own thread)
+        self.pipeline = pipeline.Pipeline(writer=station.writer_load(self.projectfile),
+                                          budget=self.configfile.get("drain_budget", 0.08),
+                                          frames=self.configfile.get("drain_frames", 1000))
+
         # call view (handles the graphics of GUI)
         self.view = view.View(self)
 
         # call server (handles the tcp connection)
         self.server = tcpserver.Server()
-
-        # call csv handler
-        self.csv = csvhandler.CSV()
+        # PLCs with own project routed to own channels of the server [(channel, station)]
+        self.stations = []
+        # process the data of the main channel with the main project
+        self.pipeline.call(self.pipeline.stations_set, [(self.server.channel, self.main)])
 
     def run(self):
         """
@@ -83,6 +93,8 @@ class Controller(object):
         """
         stop mainloop of programm
         """
+        # save the received data and close the csv files
+        self.pipeline.close()
         # write eventmessage
         self.view.eventframe_post("Programm stopped")
         # stop mainloop
@@ -104,9 +116,20 @@ class Controller(object):
         self.led_state()
         # check for servermessage
         self.server_message()
-        # check new serverdata
+        # restart csv trigger if trigger time is changed
+        if self.view.csv_timechange:
+            self.view.csv_timechange = False
+            self.pipeline.call(self.main.csv_setup)
+        # show processed serverdata (and data of the routed stations)
         self.server_data()
 
+    def project_set(self):
+        """
+        pass the new or opened project to the processing thread (main project and writer thread of the csv files)
+        """
+        self.pipeline.call(self.main.project_set, self.projectfile)
+        self.pipeline.call(self.pipeline.writer_set, station.writer_load(self.projectfile, self.pipeline.writer))
+
     def file_new(self):
         """
         open empty project file
@@ -115,6 +138,7 @@ class Controller(object):
         # read JSON file
         with open("empty.cplc") as file:
             self.projectfile = json.load(file)
+        self.project_set()
         # refresh variables on screen server
         self.view.home_update()
         # refresh variables on screen server
@@ -142,6 +166,7 @@ class Controller(object):
             # read JSON file
             with open(path) as file:
                 self.projectfile = json.load(file)
+            self.project_set()
             # refresh variables on screen server
             self.view.home_update()
             # refresh variables on screen server
@@ -243,30 +268,38 @@ class Controller(object):
         # reset data
         self.view.datatree_update()
         self.projectfile["csv_booltrigger"] = 0
+        self.projectfile["csv_timestamp"] = 0
         self.view.csv_rowdata = [{"Text": "", "Variable": 0}]
         self.projectfile["csv_rowdata"] = self.view.csv_rowdata.copy()
         self.view.home_update()
         self.view.csv_update()
         self.view.csv_row.set(1)
         self.view.csv_numrows.set(len(self.view.csv_rowdata))
+        self.pipeline.call(self.main.project_set, self.projectfile)
 
     def server_start(self):
         """
         start server
         """
-        ip = "{byte1}.{byte2}.{byte3}.{byte4}".format(byte1=str(int(self.projectfile["con_ip_byte1"])),
-                                                      byte2=str(int(self.projectfile["con_ip_byte2"])),
-                                                      byte3=str(int(self.projectfile["con_ip_byte3"])),
-                                                      byte4=str(int(self.projectfile["con_ip_byte4"])))
-        port = int(self.projectfile["con_port"])
+        ip, port = station.address_get(self.projectfile)
         datasize = int(float(self.projectfile["udt_datasize"]))
-        self.server.start(ip=ip, port=port, datasize=datasize)
+        # open the projects of the routed PLCs
+        self.stations, errormessages = station.stations_load(self.projectfile.get("con_routes", []), port)
+        for errormessage in errormessages:
+            # write eventmessage
+            self.view.eventframe_post(errormessage)
+        self.pipeline.call(self.pipeline.stations_set, [(self.server.channel, self.main)] + self.stations)
+        self.pipeline.call(self.main.csv_setup)
+        self.server.start(ip=ip, port=port, datasize=datasize, routes=[channel for channel, routed in self.stations],
+                          ackmode=self.projectfile.get("con_ackmode", "saved"))
 
     def server_stop(self):
         """
         stop server
         """
         self.server.stop()
+        # write the buffered csv rows
+        self.pipeline.call(self.pipeline.stations_close)
 
     def server_message(self):
         """
@@ -283,40 +316,60 @@ class Controller(object):
 
     def server_data(self):
         """
-        check for new data from server
-        process data
-        write answer to server
+        show the data processed since the last cycle (main project and routed stations)
+        take one snapshot of every station from the processing thread and refresh the GUI once
         """
-        try:  # try to get data from recvbuffer
-            recv = self.server.buffer_recv.get(block=False)
-        except queue.Empty:  # error if recvbuffer is empty
-            pass
-        else:  # data from recvbuffer taken
-            # convert received bytestring to list of integer
-            receivedbytes = list(recv)
+        snapshot = self.pipeline.snapshot("")
+        if snapshot is None:
+            return
+        self.snapshot = snapshot
+        for message in snapshot.errors:
+            # write eventmessage
+            self.view.eventframe_post(message)
+        if snapshot.frames > 0:
             # write eventmessage
             message = "Server received data"
+            if snapshot.frames > 1:
+                message = "Server received {frames} frames".format(frames=snapshot.frames)
             if self.projectfile["con_show_recvdata"]:
-                message = "{msg}: {data}".format(msg=message, data=receivedbytes)
+                # convert last received bytestring to list of integer
+                message = "{msg}: {data}".format(msg=message, data=list(snapshot.recv))
             self.view.eventframe_post(message)
-            # work with received data
-            readplc.get_plc_data(receivedbytes=receivedbytes, datastructure=self.projectfile["udt_datastructure"])
-            # update the values in datatree with the new received data
-            self.view.datatree_values_set()
-            # check if csv needs to me saved
-            csv_saved = self.csv_save()
-            if csv_saved:
-                sendbytes = str.encode("Saved     ")
-            else:
-                sendbytes = str.encode("Recieved  ")
-            # put data in sendbuffer (answer)
-            self.server.buffer_send.put(sendbytes)
+            # update the changed values in datatree with the latest received data
+            self.view.datatree_values_set(snapshot.changed)
+        # rows can be saved without a received frame (time trigger)
+        self.csv_show(snapshot)
+        depth = snapshot.depth
+        for channel, routed in self.stations:
+            snapshot = self.pipeline.snapshot(routed.name)
+            if snapshot is None:
+                continue
+            for message in snapshot.rows_messages():
+                self.view.eventframe_post("[{name}] {message}".format(name=routed.name, message=message))
+            for message in snapshot.errors:
+                self.view.eventframe_post("[{name}] {message}".format(name=routed.name, message=message))
+            depth += snapshot.depth
+        # show number of frames waiting for processing and the state of the csv writer thread
+        metrics = None
+        if self.pipeline.writer is not None:
+            metrics = self.pipeline.writer.metrics()
+        self.view.queue_depth_set(depth, metrics)
+
+    def decoder_subscribe(self, consumer, indexes):
+        """
+        pass the elements a consumer needs to the decoder of the main project
+        only the subscribed elements get decoded
+        """
+        self.pipeline.call(self.main.subscribe, consumer, indexes)
 
     @staticmethod
-    def timestamp_get():
+    def timestamp_get(moment=None):
         """
         get actual timestamp from clock
+        or format the timestamp of the PLC (datetime of a DTL)
         """
+        if moment is not None:
+            return moment.strftime("%d.%m.%Y %H:%M:%S.%f")
         return time.strftime("%d.%m.%Y %H:%M:%S")
 
     def led_state(self):
@@ -330,51 +383,23 @@ class Controller(object):
         elif self.server.active and self.server.connected:
             self.view.led_state("ok")
 
-    def csv_save(self):
-        """
-        exchange data with csv-handler
-        """
-        message = None
-        data = self.projectfile["udt_datastructure"]
-        self.csv.active = self.projectfile["csv_active"]
-        self.csv.filename = self.projectfile["csv_filename"]
-        self.csv.filepath = self.projectfile["csv_filepath"]
-        self.csv.filemode = self.projectfile["csv_filemode"]
-        self.csv.triggermode = self.projectfile["csv_triggermode"]
-        self.csv.time = self.projectfile["csv_time"]
-        self.csv.delimiter = self.projectfile["csv_delimiter"]
-        # refresh csv header and data
-        self.csv.header = []
-        self.csv.data = []
-        if len(data) > 0:
-            for element in self.projectfile["csv_rowdata"]:
-                self.csv.header.append(element["Text"])
-                index = element["Variable"]
-                self.csv.data.append(data[index]["value"])
-        # set csv trigger from boolean variable
-        if self.csv.triggermode == "boolean" and self.projectfile["csv_booltrigger"] > 0:
-            index = self.projectfile["csv_booltrigger"]
-            state = data[index]["value"].lower() == "true"
-            self.csv.trigger = state
-        # check if csv should run
-        if self.csv.active and self.server.active and self.server.connected and not self.view.csv_timechange:
-            message = self.csv.trigger_check()
-        else:
-            self.csv.trigger_reset()
-            self.view.csv_timechange = False
-        nexttrigger = time.strftime("%H:%M:%S", time.localtime(self.csv.nexttrigger))
+    def csv_show(self, snapshot):
+        """
+        show next trigger and the saved csv rows of the snapshot
+        """
+        nexttrigger = time.strftime("%H:%M:%S", time.localtime(snapshot.nexttrigger))
         nexttrigger = "{text}: {next}".format(text="next Trigger", next=nexttrigger)
         self.view.csv_nexttrigger.set(nexttrigger)
-        if message is not None:
-            # write eventmessage
+        if not snapshot.rows:
+            return
+        for message, moment, header, data, job in snapshot.rows:
+            # save data of the job set in the GUI in screen home
+            if job == "":
+                self.view.csv_table_insert(self.timestamp_get(moment), header, data)
+        # write eventmessage (once per cycle and job, every frame can be saved)
+        for message in snapshot.rows_messages():
             self.view.eventframe_post(message)
-            # save data in screen home
-            self.view.csv_table_insert(self.timestamp_get(), self.csv.header, self.csv.data)
-            csv_saved = True
-        else:
-            csv_saved = False
         self.view.csv_table_scroll()
-        return csv_saved
 
 
 if __name__ == '__main__':
@@ -0,0 +1,154 @@
+"""
+ConPlc - connect PLC and PC
+Copyright (C) 2021  Marvin Mangold (Marvin.Mangold00@googlemail.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import logging
+import queue
+import signal
+import sys
+import tcpserver
+import station
+import pipeline
+
+log = logging.getLogger("conplcd")
+
+
+class Daemon(object):
+    def __init__(self, path):
+        """
+        ConPlc without GUI (service on servers)
+        receive the data of the PLCs, save csv like set in the project file and log the events
+        """
+        # processing of the main project (decoder and csv handler)
+        self.main = station.station_load(name="", path=path)
+        # PLCs with own project routed to own channels of the server [(channel, station)]
+        self.stations = []
+        # call server (handles the tcp connection)
+        self.server = tcpserver.Server()
+        # call pipeline (processes the received data in its own thread)
+        self.pipeline = pipeline.Pipeline(writer=station.writer_load(self.main.projectfile))
+        self.written = 0  # number of csv rows written by the writer thread (last logged)
+        self.dropped = 0  # number of csv rows lost by the writer thread (last logged)
+        self.active = False
+        self.error = False
+
+    def start(self):
+        """
+        open the projects of the routed PLCs and start server
+        """
+        ip, port = station.address_get(self.main.projectfile)
+        self.stations, errormessages = station.stations_load(self.main.projectfile.get("con_routes", []), port)
+        for errormessage in errormessages:
+            log.warning(errormessage)
+        self.pipeline.call(self.pipeline.stations_set, [(self.server.channel, self.main)] + self.stations)
+        self.server.start(ip=ip, port=port, datasize=self.main.datasize(),
+                          routes=[channel for channel, routed in self.stations],
+                          ackmode=self.main.projectfile.get("con_ackmode", "saved"))
+        self.active = True
+
+    def stop(self, signum=None, frame=None):
+        """
+        stop mainloop (signal handler)
+        """
+        self.active = False
+
+    def run(self, interval=1.0):
+        """
+        start server and log the messages of the server and the stations until stopped
+        return exit status (1 if the server stopped with error)
+        """
+        log.info("Programm started")
+        self.start()
+        while self.active:
+            self.server_message(timeout=interval)
+            self.report()
+        self.server.stop()
+        # save the frames that are already received and close the csv files
+        if not self.pipeline.close(timeout=5):
+            log.warning("Received data not processed")
+        self.report()
+        while self.server_message():
+            pass
+        log.info("Programm stopped")
+        return 1 if self.error else 0
+
+    def server_message(self, timeout=None):
+        """
+        log the next message of the server (wait for it if a timeout is given)
+        return False if there was no message
+        """
+        try:
+            event, message = self.server.buffer_message.get(block=timeout is not None, timeout=timeout)
+        except queue.Empty:  # error if queue is empty
+            return False
+        if event == "stop":
+            log.error(message)
+            self.error = True
+            self.active = False
+        else:
+            log.info(message)
+        return True
+
+    def report(self):
+        """
+        log the saved csv rows and the received frames of all stations and the metrics of the csv writer
+        """
+        for channel, routed in [(self.server.channel, self.main)] + self.stations:
+            snapshot = self.pipeline.snapshot(routed.name)
+            if snapshot is None:
+                continue
+            prefix = "[{name}] ".format(name=routed.name) if routed.name else ""
+            if snapshot.frames > 0:
+                log.debug("{prefix}Server received {frames} frames".format(prefix=prefix, frames=snapshot.frames))
+            for message in snapshot.rows_messages():
+                log.info("{prefix}{message}".format(prefix=prefix, message=message))
+            for message in snapshot.errors:
+                log.error("{prefix}{message}".format(prefix=prefix, message=message))
+        if self.pipeline.writer is not None:
+            metrics = self.pipeline.writer.metrics()
+            if metrics["written"] > self.written:
+                log.debug("CSV writer: {depth} rows queued, {written} written, latency {latency:.3f} s".format(
+                    **metrics))
+                self.written = metrics["written"]
+            if metrics["dropped"] > self.dropped:
+                log.warning("CSV writer: {dropped} rows lost".format(dropped=metrics["dropped"] - self.dropped))
+                self.dropped = metrics["dropped"]
+
+
+def main(argv=None):
+    """
+    parse arguments, setup logging and run daemon
+    """
+    parser = argparse.ArgumentParser(description="ConPlc without GUI: receive data of the PLCs and save csv")
+    parser.add_argument("project", nargs="?", default="default.cplc", help="project file (default.cplc)")
+    parser.add_argument("--log", default="", help="log events to this file too")
+    parser.add_argument("--verbose", action="store_true", help="log every received frame")
+    args = parser.parse_args(argv)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if args.log:
+        handlers.append(logging.FileHandler(args.log, encoding="utf-8"))
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s", handlers=handlers)
+    daemon = Daemon(args.project)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    return daemon.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -19,6 +19,432 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import time
 import csv
 import os
+import shutil
+import threading
+import collections
+import gzip
+import lzma
+import bz2
+
+# seconds of one unit of the time of the time based triggermodes ("change": heartbeat)
+intervals = {"seconds": 1, "minutes": 60, "hours": 60 * 60, "change": 1}
+
+# what happens with a row if the queue of the writer thread is full
+overflows = ["block", "drop-oldest", "spill"]
+
+# errors writing a row (file system, encoding, values of the row)
+write_errors = (OSError, ValueError, LookupError, csv.Error)
+
+# compression of the closed files of the rotation {name: (open function, extension)}
+compressions = {"gzip": (gzip.open, ".gz"),
+                "xz": (lzma.open, ".xz"),
+                "bz2": (bz2.open, ".bz2")}
+
+
+def get_deadband(text):
+    """
+    read deadband of a column ("0.5" = absolute, "2%" = percent of the last saved value)
+    return (deadband, percent), (0.0, False) saves every change
+    """
+    text = str(text).strip()
+    percent = text.endswith("%")
+    try:
+        deadband = abs(float(text.rstrip("%")))
+    except ValueError:
+        return 0.0, False
+    return deadband, percent
+
+
+class Writer(object):
+    def __init__(self, errors=None):
+        """
+        csv file that stays open from row to row
+        the rows are buffered and flushed to the file by rows, time or bytes (a limit of 0 flushes every row)
+        the file is closed and renamed by size, rows or time (rotation), the next row starts a new file
+        the closed files are compressed in a thread of the writer (one file after another)
+        errors: list of the messages of the errors of the rotation and compression
+        """
+        self.errors = errors if errors is not None else []
+        self.file = None
+        self.filepath = ""
+        self.delimiter = ";"
+        self.encoding = "utf-8"  # encoding of the file, characters that can not be encoded are replaced
+        self.filewriter = None
+        self.buffersize = 65536  # size of the file buffer in bytes
+        self.flush_rows = 100  # flush after this number of rows
+        self.flush_time = 1.0  # flush this number of seconds after the first row not flushed
+        self.flush_bytes = 65536  # flush after this number of bytes
+        self.rows = 0  # number of rows not flushed
+        self.bytes = 0  # number of bytes not flushed
+        self.since = 0.0  # time of the first row not flushed (monotonic clock)
+        self.rotate_size = 0  # start a new file after this number of bytes (0 = no rotation)
+        self.rotate_rows = 0  # start a new file after this number of rows (0 = no rotation)
+        self.rotate_time = 0.0  # start a new file this number of seconds after it is opened (0 = no rotation)
+        self.compression = ""  # compression of the closed files ("gzip", "xz", "bz2", "" = not compressed)
+        self.size = 0  # bytes of the file
+        self.count = 0  # rows written to the file since it is opened
+        self.rotations = 0  # number of rotations of the file
+        self.opened = 0.0  # time the file is opened (monotonic clock)
+        self.segments = collections.deque()  # closed files to compress [(filepath, compression)]
+        self.lock = threading.Lock()
+        self.compressor = None  # thread compressing the closed files
+
+    def open(self, filepath, header):
+        """
+        close the actual file and open the file of the filepath (append)
+        write the header if the file is new
+        return True if the file is new
+        """
+        self.close()
+        self.size = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+        new = self.size == 0
+        self.file = open(filepath, mode="a", newline='', buffering=self.buffersize, encoding=self.encoding,
+                         errors="replace")
+        self.filepath = filepath
+        self.count = 0
+        self.opened = time.monotonic()
+        self.filewriter = csv.writer(self.file, delimiter=self.delimiter)
+        if new:
+            self.write(header)
+        return new
+
+    def write(self, data):
+        """
+        write one row to the buffer and flush if a limit is reached
+        """
+        if self.rows == 0:
+            self.since = time.monotonic()
+        written = self.filewriter.writerow(data)
+        self.bytes += written
+        self.size += written
+        self.rows += 1
+        self.flush_check()
+
+    def row(self, filepath, delimiter, header, data):
+        """
+        write one row to the file of the filepath
+        the file is opened only if another file is used (new day, changed settings)
+        return True if the file is new
+        """
+        new = False
+        if delimiter != self.delimiter:
+            self.delimiter = delimiter
+            if self.file is not None:
+                self.filewriter = csv.writer(self.file, delimiter=self.delimiter)
+        if self.file is None or filepath != self.filepath:
+            new = self.open(filepath, header)
+        self.write(data)
+        self.count += 1
+        self.rotate_check()
+        return new
+
+    def rotate_check(self):
+        """
+        close and rename the file if a limit of the rotation is reached
+        """
+        if ((self.rotate_size > 0 and self.size >= self.rotate_size) or
+                (self.rotate_rows > 0 and self.count >= self.rotate_rows) or
+                (self.rotate_time > 0 and time.monotonic() - self.opened >= self.rotate_time)):
+            self.rotate()
+
+    def rotate(self):
+        """
+        close the file and rename it with the time of the rotation, the next row starts a new file
+        the renamed file is compressed in the background if set
+        sample: newfile_.csv --> newfile__2021_05_14_12_00_00.csv(.gz)
+        """
+        filepath = self.filepath
+        self.close()
+        self.rotations += 1
+        root, extension = os.path.splitext(filepath)
+        name = "{root}_{time}".format(root=root, time=time.strftime("%Y_%m_%d_%H_%M_%S"))
+        segment = name + extension
+        endings = [""] + [ending for function, ending in compressions.values()]
+        number = 0
+        # more than one rotation in a second
+        while any(os.path.exists(segment + ending) for ending in endings):
+            number += 1
+            segment = "{name}_{number}{extension}".format(name=name, number=number, extension=extension)
+        try:
+            os.replace(filepath, segment)
+        except OSError as errormessage:
+            self.errors.append("CSV - {path} not rotated: {errormessage}".format(path=filepath,
+                                                                                errormessage=errormessage))
+            return
+        if self.compression in compressions:
+            self.compress(segment, self.compression)
+
+    def compress(self, filepath, compression):
+        """
+        compress a closed file in the thread of the writer (started if not running)
+        the thread is no daemon, the program ends after the queued files are compressed
+        """
+        with self.lock:
+            self.segments.append((filepath, compression))
+            if self.compressor is None:
+                self.compressor = threading.Thread(target=self.compress_run, args=())
+                self.compressor.start()
+
+    def compress_run(self):
+        """
+        compress the queued files one after another and delete them, end if no file is queued
+        """
+        while True:
+            with self.lock:
+                if not self.segments:
+                    self.compressor = None
+                    return
+                filepath, compression = self.segments.popleft()
+            function, extension = compressions[compression]
+            target = filepath + extension
+            try:
+                with open(filepath, mode="rb") as source, function(target, mode="wb") as destination:
+                    shutil.copyfileobj(source, destination, 1024 * 1024)
+                os.remove(filepath)
+            except OSError as errormessage:
+                self.errors.append("CSV - {path} not compressed: {errormessage}".format(path=filepath,
+                                                                                       errormessage=errormessage))
+                # keep the uncompressed file
+                if os.path.exists(filepath) and os.path.exists(target):
+                    try:
+                        os.remove(target)
+                    except OSError:
+                        pass
+
+    def flush_check(self):
+        """
+        flush the buffered rows if a limit is reached
+        """
+        if self.rows == 0:
+            return
+        if (self.rows >= self.flush_rows or self.bytes >= self.flush_bytes or
+                time.monotonic() - self.since >= self.flush_time):
+            self.flush()
+
+    def flush(self):
+        """
+        write the buffered rows to the file
+        """
+        if self.file is not None:
+            self.file.flush()
+        self.rows = 0
+        self.bytes = 0
+
+    def close(self):
+        """
+        flush and close the file
+        """
+        if self.file is not None:
+            try:
+                self.file.close()
+            finally:
+                self.file = None
+                self.filewriter = None
+                self.filepath = ""
+                self.rows = 0
+                self.bytes = 0
+
+    def discard(self):
+        """
+        close the file after an error (the buffered rows are lost)
+        """
+        try:
+            self.close()
+        except OSError:
+            pass
+
+
+class WriterThread(object):
+    def __init__(self, size=1000, overflow="block", spillpath="spill", interval=0.2):
+        """
+        write the csv files in a background thread, the rows are handed over by a bounded queue
+        if the queue is full the row waits (block), replaces the oldest row (drop-oldest)
+        or is written to a file on the local disk (spill)
+        """
+        self.size = 1  # maximum number of jobs in the queue
+        self.overflow = "block"
+        self.spillpath = ""  # directory of the spilled rows
+        self.interval = interval  # seconds between the checks of the file buffers if no row is queued
+        self.jobs = collections.deque()  # jobs [(kind, csv, function, args, queued)]
+        self.condition = threading.Condition()
+        self.configure(size, overflow, spillpath)
+        self.running = True  # the thread ends after the queued jobs if False
+        self.csvs = set()  # csv handlers with an open file
+        # metrics
+        self.written = 0  # number of written rows
+        self.dropped = 0  # number of rows lost (queue full or spill file not written)
+        self.spilled = 0  # number of rows written to the spill files
+        self.latency = 0.0  # maximum time from queued to written since the last metrics
+        # threading parameters
+        self.thread = threading.Thread(target=self.run, args=())  # function to be running in thread
+        self.thread.daemon = True  # setup thread to end after main programm ends
+        self.thread.start()  # start thread
+
+    def configure(self, size=1000, overflow="block", spillpath="spill"):
+        """
+        set queue size and overflow (another project opened), the queued jobs are kept
+        """
+        with self.condition:
+            self.size = max(int(size), 1)
+            self.overflow = overflow if overflow in overflows else "block"
+            self.spillpath = spillpath
+            self.condition.notify_all()
+
+    def stop(self):
+        """
+        end the thread after the queued jobs (jobs queued later are done in the calling thread)
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def row(self, csvhandler, filepath):
+        """
+        queue the actual row of a csv handler
+        return True if the file is new (another file or the file is rotated since the last row)
+        """
+        new = False
+        if filepath != csvhandler.queued_filepath or csvhandler.writer.rotations != csvhandler.queued_rotations:
+            new = not os.path.exists(filepath) or os.path.getsize(filepath) == 0
+            csvhandler.queued_filepath = filepath
+            csvhandler.queued_rotations = csvhandler.writer.rotations
+        self.put(("row", csvhandler, csvhandler.writer.row,
+                  (filepath, csvhandler.delimiter, csvhandler.header, csvhandler.data), time.monotonic()))
+        return new
+
+    def close(self, csvhandler):
+        """
+        queue closing the file of a csv handler
+        """
+        csvhandler.queued_filepath = ""
+        self.put(("close", csvhandler, csvhandler.writer.close, (), time.monotonic()))
+
+    def put(self, job):
+        """
+        put a job to the queue, if the queue is full handle the rows like set in overflow
+        if the writer thread is stopped or ended the queued jobs are done in the calling thread
+        """
+        with self.condition:
+            full = len(self.jobs) >= self.size and job[0] == "row"
+            spill = full and self.overflow == "spill" and self.running and self.thread.is_alive()
+            if not spill:
+                if full and self.overflow == "drop-oldest":
+                    for oldjob in self.jobs:
+                        if oldjob[0] == "row":
+                            self.jobs.remove(oldjob)
+                            self.dropped += 1
+                            break
+                while len(self.jobs) >= self.size and self.running and self.thread.is_alive():
+                    self.condition.wait(self.interval)
+                self.jobs.append(job)
+                self.condition.notify_all()
+                if self.running and self.thread.is_alive():
+                    return
+        if spill:
+            # write the row on the local disk without holding the queue
+            self.spill(job)
+            return
+        # wait until the thread has done its last jobs, then do the rest
+        self.thread.join()
+        with self.condition:
+            jobs = list(self.jobs)
+            self.jobs.clear()
+        self.execute(jobs)
+
+    def spill(self, job):
+        """
+        write a row to the spill file on the local disk (same filename as the csv file)
+        the spill file is written in the thread that queues the rows
+        """
+        kind, csvhandler, function, (filepath, delimiter, header, data), queued = job
+        try:
+            os.makedirs(self.spillpath, exist_ok=True)
+            csvhandler.spill.row(os.path.join(self.spillpath, os.path.basename(filepath)), delimiter, header, data)
+            with self.condition:
+                self.spilled += 1
+        except write_errors as errormessage:
+            csvhandler.spill.discard()
+            with self.condition:
+                self.dropped += 1
+            csvhandler.errors.append("CSV - row not spilled: {errormessage}".format(errormessage=errormessage))
+
+    def wait(self, timeout=None):
+        """
+        wait until all queued jobs are done
+        return False if the jobs are not done within the timeout
+        """
+        done = threading.Event()
+        self.put(("call", None, done.set, (), time.monotonic()))
+        return done.wait(timeout)
+
+    def metrics(self):
+        """
+        return the metrics of the writer (the latency is the maximum since the last call)
+        """
+        with self.condition:
+            latency = self.latency
+            self.latency = 0.0
+            return {"depth": len(self.jobs), "written": self.written, "dropped": self.dropped,
+                    "spilled": self.spilled, "latency": latency}
+
+    def run(self):
+        """
+        take all queued jobs at once and do them one after another (rows of many frames in one batch)
+        flush the file buffers when the limits are reached
+        """
+        while True:
+            with self.condition:
+                if not self.jobs and self.running:
+                    self.condition.wait(self.interval)
+                jobs = list(self.jobs)
+                self.jobs.clear()
+                self.condition.notify_all()
+                if not jobs and not self.running:
+                    return
+            if not jobs:
+                self.flush_check()
+                continue
+            self.execute(jobs)
+
+    def execute(self, jobs):
+        """
+        do the jobs one after another, an error loses only the row of the job
+        """
+        written = 0
+        for kind, csvhandler, function, args, queued in jobs:
+            try:
+                function(*args)
+            except Exception as errormessage:
+                if csvhandler is None:
+                    continue
+                path = args[0] if kind == "row" else csvhandler.writer.filepath
+                csvhandler.writer.discard()
+                csvhandler.errors.append("CSV - {path} not saved: {errormessage}".format(path=path,
+                                                                                        errormessage=errormessage))
+                if kind == "row":
+                    with self.condition:
+                        self.dropped += 1
+                continue
+            if kind == "row":
+                self.csvs.add(csvhandler)
+                written += 1
+            elif kind == "close":
+                self.csvs.discard(csvhandler)
+        with self.condition:
+            self.written += written
+            self.latency = max(self.latency, time.monotonic() - jobs[0][4])
+
+    def flush_check(self):
+        """
+        flush the file buffers of all csv handlers if a limit is reached
+        """
+        for csvhandler in list(self.csvs):
+            try:
+                csvhandler.writer.flush_check()
+            except OSError as errormessage:
+                csvhandler.errors.append("CSV - {path} not saved: {errormessage}".format(
+                    path=csvhandler.writer.filepath, errormessage=errormessage))
+                csvhandler.writer.discard()
 
 
 class CSV(object):
@@ -34,69 +460,203 @@ class CSV(object):
         self.time = ""
         self.trigger = False
         self.trigger_lastcheck = False
-        self.nexttrigger = time.time()
+        self.nexttrigger = time.time()  # time of the next time trigger (clock, for display)
+        self.deadline = time.monotonic()  # time of the next time trigger (monotonic clock)
+        self.interval = 0  # seconds between the time triggers (0 = not time based)
+        self.align = True  # time triggers on multiples of the interval (full minutes, ...)
+        self.missed = 0  # time triggers missed since the last saved row
         self.header = []
         self.data = []
         self.delimiter = ";"
+        self.errors = []  # messages of the errors writing the file (taken by the reader)
+        self.writer = Writer(self.errors)
+        self.spill = Writer(self.errors)  # file on the local disk for the rows the writer thread can not take
+        self.background = None  # writer thread (None = write the file in the calling thread)
+        self.queued_filepath = ""  # file of the last row handed to the writer thread
+        self.queued_rotations = 0  # rotations of the file when the last row was handed to the writer thread
+        # change mode: values of the columns (tuple), values of the last saved row and deadbands [(deadband, percent)]
+        self.values = ()
+        self.lastvalues = None
+        self.deadbandtexts = []
+        self.deadbands = []
+
+    def deadbands_set(self, texts):
+        """
+        set the deadbands of the columns (change mode) from their texts
+        """
+        if texts != self.deadbandtexts:
+            self.deadbandtexts = list(texts)
+            self.deadbands = [get_deadband(text) for text in texts]
+
+    def changed(self):
+        """
+        check if the value of a column changed beyond its deadband since the last saved row
+        values that are not numbers are changed if not equal
+        """
+        if self.lastvalues is None or len(self.lastvalues) != len(self.values):
+            return True
+        # most frames change nothing
+        if self.values == self.lastvalues:
+            return False
+        for value, lastvalue, (deadband, percent) in zip(self.values, self.lastvalues, self.deadbands):
+            if value == lastvalue:
+                continue
+            if value != value or lastvalue != lastvalue:
+                # NaN is not changed by another NaN, but by every number
+                if value != value and lastvalue != lastvalue:
+                    continue
+                return True
+            if deadband == 0:
+                return True
+            try:
+                if percent:
+                    limit = abs(lastvalue) * deadband / 100
+                else:
+                    limit = deadband
+                if abs(value - lastvalue) > limit:
+                    return True
+            except TypeError:  # value is not a number
+                return True
+        return False
 
     def trigger_reset(self):
         """
         reset trigger
         if trigger is time based, set next trigger
+        the time triggers are aligned to multiples of the interval of the local time (full minutes, ...) if set
+        the heartbeat of change mode starts with the reset
         """
         if (not self.time.isdigit()) or (int(self.time) < 1):
             self.time = "1"
-        self.nexttrigger = time.time()
-        if self.triggermode == "boolean":
-            pass
-        elif self.triggermode == "seconds":
-            self.nexttrigger = self.nexttrigger + int(self.time)
-        elif self.triggermode == "minutes":
-            self.nexttrigger = self.nexttrigger + (int(self.time) * 60)
-        elif self.triggermode == "hours":
-            self.nexttrigger = self.nexttrigger + (int(self.time) * 60 * 60)
+        self.interval = intervals.get(self.triggermode, 0) * int(self.time)
+        now = time.monotonic()
+        self.deadline = now + self.interval
+        if self.interval > 0 and self.align and self.triggermode != "change":
+            clock = time.time()
+            offset = time.localtime(clock).tm_gmtoff
+            # next multiple of the interval (local time) as time of the monotonic clock
+            self.deadline = now + ((clock + offset) // self.interval + 1) * self.interval - offset - clock
+        self.nexttrigger = time.time() + self.deadline - now
+        self.missed = 0
         self.trigger = False
+        self.lastvalues = None
 
-    def trigger_check(self):
+    def schedule(self, now):
+        """
+        set the next time trigger one interval after the actual one (no drift)
+        the time triggers already passed are skipped and counted as missed
+        """
+        slots = int((now - self.deadline) // self.interval) + 1
+        self.missed += slots - 1
+        self.deadline += slots * self.interval
+        self.nexttrigger = time.time() + self.deadline - now
+
+    def skip(self):
+        """
+        skip the reached time trigger without saving a row (no new data) and count it as missed
+        """
+        self.schedule(time.monotonic())
+        self.missed += 1
+
+    def due(self):
+        """
+        check if the time trigger is reached (time based triggermodes and heartbeat of change mode)
+        """
+        return self.interval > 0 and time.monotonic() >= self.deadline
+
+    def triggered(self):
         """
         if trigger in time mode and time is up --> set Trigger True
         if trigger is already set by extern go on
         save csv if trigger is True rising edge
+        in frame mode save csv every call (every received frame)
+        in change mode save csv if a value changed beyond its deadband or the heartbeat time is up
+        return True if a row needs to be saved (the trigger is reset)
         """
-        message = None
         save_timetriger = False
         save_booltrigger = False
         # if trigger in time mode and time is up --> set Trigger True
-        if self.triggermode != "boolean":
-            save_timetriger = time.time() > self.nexttrigger
+        if self.triggermode == "frame":
+            # every frame is saved
+            save_timetriger = True
+        elif self.triggermode == "change":
+            save_timetriger = time.monotonic() >= self.deadline or self.changed()
+        elif self.triggermode != "boolean":
+            save_timetriger = time.monotonic() >= self.deadline
         elif self.triggermode == "boolean":
             # check if trigger is True rising edge
             save_booltrigger = self.trigger and not self.trigger_lastcheck
             self.trigger_lastcheck = self.trigger
         if save_timetriger or save_booltrigger:
-            self.trigger_reset()
-            # check filemode 1 = new file everyday, 2 = one big file
-            if self.filemode == 1:
-                # create filename (C:/Users/Username/Desktop/newfile_2021_05_14.csv)
-                date = time.strftime("%Y_%m_%d")
+            if self.triggermode in ("seconds", "minutes", "hours"):
+                self.schedule(time.monotonic())
+            elif self.triggermode != "frame":
+                self.trigger_reset()
+            if self.triggermode == "change":
+                self.lastvalues = tuple(self.values)
+            return True
+        return False
+
+    def save(self):
+        """
+        save header (new file) and data as row of the csv file
+        return message of the saved row (None if not saved)
+        """
+        message = None
+        # check filemode 1 = new file everyday, 2 = one big file
+        if self.filemode == 1:
+            # create filename (C:/Users/Username/Desktop/newfile_2021_05_14.csv)
+            date = time.strftime("%Y_%m_%d")
+        else:
+            # create filename (C:/Users/Username/Desktop/newfile.csv)
+            date = ""
+        # check delimiter
+        if len(self.delimiter) > 1 or len(self.delimiter) < 1:
+            self.delimiter = ";"
+        # create filepath
+        filepath = "{dir}/{file}_{date}.csv".format(dir=self.filepath, file=self.filename, date=date)
+        try:
+            if self.background is not None:
+                new = self.background.row(self, filepath)
             else:
-                # create filename (C:/Users/Username/Desktop/newfile.csv)
-                date = ""
-            # check delimiter
-            if len(self.delimiter) > 1 or len(self.delimiter) < 1:
-                self.delimiter = ";"
-            # create filepath
-            filepath = "{dir}/{file}_{date}.csv".format(dir=self.filepath, file=self.filename, date=date)
-            # check if file already exists
-            if os.path.exists(filepath):
-                with open(filepath, mode="a", newline='') as file:
-                    filewriter = csv.writer(file, delimiter=self.delimiter)
-                    filewriter.writerow(self.data)  # write data
-                    message = "CSV - {path} appended".format(path=filepath)
+                new = self.writer.row(filepath, self.delimiter, self.header, self.data)
+            if new:
+                message = "CSV - {path} saved".format(path=filepath)
             else:
-                with open(filepath, mode="w", newline='') as file:
-                    filewriter = csv.writer(file, delimiter=self.delimiter)
-                    filewriter.writerow(self.header)  # write header
-                    filewriter.writerow(self.data)  # write data
-                    message = "CSV - {path} saved".format(path=filepath)
+                message = "CSV - {path} appended".format(path=filepath)
+            if self.missed > 0:
+                message = "{message} ({missed} time triggers missed)".format(message=message, missed=self.missed)
+                self.missed = 0
+        except write_errors as errormessage:
+            self.writer.discard()
+            self.errors.append("CSV - {path} not saved: {errormessage}".format(path=filepath,
+                                                                              errormessage=errormessage))
         return message
+
+    def flush_check(self):
+        """
+        flush the buffered rows if a limit is reached (call it regularly, done by the writer thread if used)
+        """
+        try:
+            if self.background is not None:
+                self.spill.flush_check()
+                return
+            self.writer.flush_check()
+        except OSError as errormessage:
+            self.writer.discard()
+            self.errors.append("CSV - {path} not saved: {errormessage}".format(path=self.writer.filepath,
+                                                                              errormessage=errormessage))
+
+    def close(self):
+        """
+        write the buffered rows and close the file (shutdown)
+        """
+        try:
+            if self.background is not None:
+                self.background.close(self)
+                self.spill.close()
+                return
+            self.writer.close()
+        except OSError as errormessage:
+            self.writer.discard()
+            self.errors.append("CSV - not saved: {errormessage}".format(errormessage=errormessage))
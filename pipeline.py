@@ -0,0 +1,294 @@
+"""
+ConPlc - connect PLC and PC
+Copyright (C) 2021  Marvin Mangold (Marvin.Mangold00@googlemail.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import queue
+import threading
+import time
+
+
+class Snapshot(object):
+    def __init__(self):
+        """
+        state of one station taken from the processing thread for the GUI
+        holds a copy of the values and everything that happened since the last snapshot
+        """
+        self.datastructure = None  # datastructure of the values
+        self.values = []  # values of all elements (copy)
+        self.textformats = []  # text format of every element
+        self.changed = set()  # indexes of the elements changed since the last snapshot
+        # saved csv rows [(message, moment, header, data, job)], moment: DTL of the row (None = clock)
+        self.rows = []
+        self.frames = 0  # number of processed frames since the last snapshot
+        self.recv = None  # last processed frame
+        self.errors = []  # messages of the errors writing the csv files
+        self.nexttrigger = 0  # time of the next csv trigger
+        self.depth = 0  # number of frames waiting for processing
+
+    def rows_messages(self):
+        """
+        messages of the saved csv rows, one for every job (message of the last row and number of rows)
+        """
+        jobs = {}  # {job: [message, rows]}
+        for message, moment, header, data, job in self.rows:
+            if job in jobs:
+                jobs[job][0] = message
+                jobs[job][1] += 1
+            else:
+                jobs[job] = [message, 1]
+        messages = []
+        for message, rows in jobs.values():
+            if rows > 1:
+                message = "{message} ({rows} rows)".format(message=message, rows=rows)
+            messages.append(message)
+        return messages
+
+    def text(self, index):
+        """
+        return the value of an element as text
+        """
+        value = self.values[index]
+        if value is None:
+            return ""
+        return self.textformats[index](value)
+
+
+class Pipeline(object):
+    def __init__(self, interval=0.2, writer=None, budget=0.08, frames=1000):
+        """
+        processing of the received data in its own thread (decode, csv trigger)
+        the csv files are written by the writer thread (if given) or by the processing thread
+        the GUI does not touch the stations, it sends commands and takes snapshots
+        budget: seconds and frames of every station processed in one cycle before the time triggers
+        and the csv buffers are checked
+        """
+        self.stations = []  # processed channels and their stations [(channel, station)]
+        self.pending = {}  # what happened since the last snapshot of every station {name: Snapshot}
+        self.commands = queue.Queue()  # calls executed by the processing thread between two frames
+        self.lock = threading.Lock()  # held while a frame is processed or a snapshot is taken
+        self.wakeup = threading.Event()  # set if a frame is received or a command is sent
+        self.interval = interval  # seconds between the checks of the csv buffers if no frame is received
+        self.budget = budget  # seconds of processing frames in one cycle
+        self.frames = max(int(frames), 1)  # frames of every station processed in one cycle
+        self.writer = writer  # writer thread of the csv files (None = write in the processing thread)
+        # threading parameters
+        self.thread = threading.Thread(target=self.run, args=())  # function to be running in thread
+        self.thread.daemon = True  # setup thread to end after main programm ends
+        self.thread.start()  # start thread
+
+    def call(self, function, *args):
+        """
+        execute function(*args) in the processing thread before the next frame
+        """
+        self.commands.put((function, args))
+        self.wakeup.set()
+
+    def stations_set(self, stations):
+        """
+        set the channels and their stations that are processed [(channel, station)]
+        (called in the processing thread, use call)
+        """
+        for channel, station in stations:
+            channel.wakeup = self.wakeup
+            station.background_set(self.writer)
+        # write the files of the stations not processed anymore
+        for channel, station in self.stations:
+            if station not in [routed for channel, routed in stations]:
+                station.close()
+        self.stations = list(stations)
+        self.pending = {}
+
+    def writer_set(self, writer):
+        """
+        write the csv files with another writer thread (None = processing thread), another project opened
+        the files are closed and the old writer thread ends after its queued rows
+        (called in the processing thread, use call)
+        """
+        if writer is self.writer:
+            return
+        for channel, station in self.stations:
+            station.close()
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer.thread.join()
+        self.writer = writer
+        for channel, station in self.stations:
+            station.background_set(writer)
+            self.error_check(station)
+
+    def wait(self, timeout=None):
+        """
+        wait until all received frames are processed and their csv rows are written
+        return False if the frames are not processed within the timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while any(channel.buffer_recv.qsize() > 0 for channel, station in self.stations):
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        # the last frame is processed when the processing thread executes the next command
+        done = threading.Event()
+        self.call(done.set)
+        if not done.wait(None if deadline is None else max(deadline - time.monotonic(), 0)):
+            return False
+        # the rows are written when the writer thread does the next job
+        if self.writer is not None:
+            return self.writer.wait(None if deadline is None else max(deadline - time.monotonic(), 0))
+        return True
+
+    def close(self, timeout=5):
+        """
+        process the received frames and close the files of all stations (shutdown)
+        return False if not done within the timeout
+        """
+        processed = self.wait(timeout)
+        self.call(self.stations_close)
+        return self.wait(timeout) and processed
+
+    def stations_close(self):
+        """
+        write the buffered csv rows of all stations and close the files
+        (called in the processing thread, use call)
+        """
+        for channel, station in self.stations:
+            station.close()
+            self.error_check(station)
+
+    def run(self):
+        """
+        wait for received frames and commands
+        process the received frames (one after another of every channel) until all buffers are empty
+        or the budget of the cycle is used, the remaining frames are processed in the next cycle
+        save csv of the time triggers reached between two frames (at the time of the trigger)
+        flush the csv buffers when the limits are reached
+        """
+        busy = False
+        while True:
+            if not busy:
+                self.wakeup.wait(self.timeout())
+            self.wakeup.clear()
+            deadline = time.monotonic() + self.budget
+            for count in range(self.frames):
+                self.commands_execute()
+                busy = False
+                for channel, station in self.stations:
+                    try:  # try to get data from recvbuffer of the channel
+                        recv = channel.frame_get()
+                    except queue.Empty:  # error if recvbuffer is empty
+                        continue
+                    busy = True
+                    self.frame_process(recv, channel, station)
+                if not busy or time.monotonic() >= deadline:
+                    break
+            with self.lock:
+                for channel, station in self.stations:
+                    # time triggers reached between two frames
+                    try:
+                        rows = station.tick()
+                        if rows:
+                            self.snapshot_pending(station.name).rows.extend(rows)
+                        station.flush_check()
+                    except Exception as errormessage:
+                        self.snapshot_pending(station.name).errors.append(
+                            "CSV - not processed: {errormessage}".format(errormessage=errormessage))
+                    self.error_check(station)
+
+    def timeout(self):
+        """
+        seconds until the next check of the csv buffers or the next time trigger of a station
+        """
+        timeout = self.interval
+        now = time.monotonic()
+        for channel, station in self.stations:
+            deadline = station.deadline()
+            if deadline is not None:
+                timeout = min(timeout, max(deadline - now, 0))
+        return timeout
+
+    def snapshot_pending(self, name):
+        """
+        return the snapshot collecting what happens with a station until the next snapshot
+        """
+        snapshot = self.pending.get(name)
+        if snapshot is None:
+            snapshot = self.pending[name] = Snapshot()
+        return snapshot
+
+    def commands_execute(self):
+        """
+        execute all commands sent by the GUI
+        an error of a command is shown with the main project, the processing goes on
+        """
+        while True:
+            try:
+                function, args = self.commands.get(block=False)
+            except queue.Empty:
+                return
+            with self.lock:
+                try:
+                    function(*args)
+                except Exception as errormessage:
+                    self.snapshot_pending("").errors.append(
+                        "Command not executed: {errormessage}".format(errormessage=errormessage))
+
+    def frame_process(self, recv, channel, station):
+        """
+        decode one frame, save csv and write answer (depending on the ackmode of the channel)
+        add the changes to the next snapshot of the station
+        an error of the frame is added to the snapshot, the next frames are processed
+        """
+        with self.lock:
+            snapshot = self.snapshot_pending(station.name)
+            snapshot.frames += 1
+            snapshot.recv = recv
+            try:
+                changed, rows = station.process(recv, channel)
+            except Exception as errormessage:
+                snapshot.errors.append("Server data not processed: {errormessage}".format(errormessage=errormessage))
+            else:
+                snapshot.changed.update(changed)
+                snapshot.rows.extend(rows)
+            self.error_check(station)
+
+    def error_check(self, station):
+        """
+        add the errors writing the csv file of a station to its next snapshot
+        """
+        errors = station.errors_take()
+        if errors:
+            self.snapshot_pending(station.name).errors.extend(errors)
+
+    def snapshot(self, name=""):
+        """
+        take the state of a station ("" = main project) and everything that happened since the last snapshot
+        return None if the station is not processed
+        """
+        with self.lock:
+            for channel, station in self.stations:
+                if station.name == name:
+                    break
+            else:
+                return None
+            snapshot = self.pending.pop(name, None)
+            if snapshot is None:
+                snapshot = Snapshot()
+            snapshot.datastructure = station.decoder.datastructure
+            snapshot.values = list(station.decoder.values)
+            snapshot.textformats = station.decoder.textformats
+            snapshot.nexttrigger = station.csv.nexttrigger
+            snapshot.depth = channel.buffer_recv.qsize()
+        return snapshot
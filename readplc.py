@@ -16,324 +16,1015 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import re
 import struct
+import datetime
+from operator import itemgetter
+from bisect import bisect_right
+from itertools import chain, islice
 
 
-def get_bool(recvbytes, element):
-    """
-    read datatype from 1 byte
-    FALSE or TRUE / 0 or 1
-    """
-    bit = int(element["byte"].split(".")[1])
-    bitmask = 1 << bit
-    data = str((recvbytes[0] & bitmask) != 0)
-    element["value"] = data
-    if bit == 7:
-        recvbytes.pop(0)
+# define struct format characters of the fixed size datatypes (big endian)
+formats = {"Byte": "B",
+           "Word": "H",
+           "DWord": "I",
+           "LWord": "Q",
+           "SInt": "b",
+           "USInt": "B",
+           "Int": "h",
+           "UInt": "H",
+           "DInt": "i",
+           "UDInt": "I",
+           "LInt": "q",
+           "ULInt": "Q",
+           "Real": "f",
+           "LReal": "d",
+           "Char": "B",
+           "WChar": "H"}
 
+# define numpy format of the fixed size datatypes (big endian)
+numpy_formats = {"Bool": "u1",
+                 "Byte": "u1",
+                 "Word": ">u2",
+                 "DWord": ">u4",
+                 "LWord": ">u8",
+                 "SInt": "i1",
+                 "USInt": "u1",
+                 "Int": ">i2",
+                 "UInt": ">u2",
+                 "DInt": ">i4",
+                 "UDInt": ">u4",
+                 "LInt": ">i8",
+                 "ULInt": ">u8",
+                 "Real": ">f4",
+                 "LReal": ">f8",
+                 "Char": "u1",
+                 "WChar": ">u2"}
 
-def get_byte(recvbytes, element):
-    """
-    read datatype from 1 byte
-    16#0 to 16#FF / 0 to 255
-    """
-    data = struct.unpack('!B', bytes([recvbytes[0]]))[0]
-    data = format(data, '#01x')
-    data = "16#{data}".format(data=data[2:]).upper()
-    element["value"] = data
-    recvbytes.pop(0)
+# size of the byte ranges that are compared between two frames
+delta_blocksize = 64
 
+# default encoding of the characters in String and WString
+string_encoding = "latin-1"
+wstring_encoding = "utf-16-be"
 
-def get_word(recvbytes, element):
-    """
-    read datatype from 2 byte
-    16#0 to 16#FFFF / 0 to 65.535
-    """
-    data = struct.unpack('!H', bytes(recvbytes[0:2]))[0]
-    data = format(data, '#04x')
-    data = "16#{data}".format(data=data[2:]).upper()
-    element["value"] = data
-    recvbytes.pop(0)
-    recvbytes.pop(0)
+# minimal number of bools in a row that are read together as one bitfield
+bitfield_minsize = 8
 
+# minimal number of elements of an array of struct or UDT that is read as one table
+structarray_minsize = 2
 
-def get_dword(recvbytes, element):
-    """
-    read datatype from 4 byte
-    16#0000_0000 to 16#FFFF_FFFF / 0 to 4.294.967.295
-    """
-    data = struct.unpack('!I', bytes(recvbytes[0:4]))[0]
-    data = format(data, '#04x')
-    data = "16#{data}".format(data=data[2:]).upper()
-    element["value"] = data
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
+# DTL: YEAR UInt, MONTH USInt, DAY USInt, WEEKDAY USInt, HOUR USInt, MINUTE USInt, SECOND USInt, NANOSECOND UDInt
+dtl_struct = struct.Struct(">HBBBBBBI")
+# numpy format of the values of a DTL (batch decoding)
+dtl_fields = [("year", ">u2"), ("month", "u1"), ("day", "u1"), ("weekday", "u1"),
+              ("hour", "u1"), ("minute", "u1"), ("second", "u1"), ("nanosecond", ">u4")]
+epoch = datetime.datetime(1970, 1, 1)
 
+# bits of every possible byte, bit 0 first {byte: (bit0, bit1, ..., bit7)}
+bytebits = tuple(tuple((value >> bit) & 1 == 1 for bit in range(8)) for value in range(256))
 
-def get_lword(recvbytes, element):
-    """
-    read datatype from 8 byte
-    16#0000_0000_0000_0000 to 16#FFFF_FFFF_FFFF_FFFF / 0 to 18.446.744.073.709.551.615
-    """
-    data = struct.unpack('!Q', bytes(recvbytes[0:8]))[0]
-    data = format(data, '#08x')
-    data = "16#{data}".format(data=data[2:]).upper()
-    element["value"] = data
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-
-
-def get_sint(recvbytes, element):
+
+def get_numpy():
     """
-    read datatype from 1 byte
-    -128 to +127
+    import numpy when frames are decoded in batches (optional, not loaded for decoding frame by frame)
     """
-    data = str(struct.unpack('!b', bytes([recvbytes[0]]))[0])
-    element["value"] = data
-    recvbytes.pop(0)
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("numpy is needed to decode frames in batches")
+    return numpy
 
 
-def get_usint(recvbytes, element):
+def get_address(element):
     """
-    read datatype from 1 byte
-    0 to 255
+    split the byteaddress of an element into byte and bit
+    sample: "10.7" --> 10, 7
     """
-    data = str(struct.unpack('!B', bytes([recvbytes[0]]))[0])
-    element["value"] = data
-    recvbytes.pop(0)
+    byte, bit = element["byte"].split(".")
+    return int(byte), int(bit)
 
 
-def get_int(recvbytes, element):
+def get_hex(digits):
     """
-    read datatype from 2 byte
-    -32.768 to +32.767
+    create formatter of unsigned integer as hex string with at least digits
+    Byte: 16#0 to 16#FF
+    Word: 16#00 to 16#FFFF
+    DWord: 16#00 to 16#FFFF_FFFF
+    LWord: 16#000000 to 16#FFFF_FFFF_FFFF_FFFF
+    sample: get_hex(2)(10) --> "16#0A"
     """
-    data = str(struct.unpack('!h', bytes(recvbytes[0:2]))[0])
-    element["value"] = data
-    recvbytes.pop(0)
-    recvbytes.pop(0)
+    def hex_text(value):
+        return "16#{data:0{digits}X}".format(data=value, digits=digits)
+    return hex_text
 
 
-def get_uint(recvbytes, element):
+def get_char(value):
     """
-    read datatype from 2 byte
-    0 to 65.535
+    read datatype from 1 byte (Char) or 2 byte (WChar)
+    ASCII-Character or Unicode-Character
     """
-    data = str(struct.unpack('!H', bytes(recvbytes[0:2]))[0])
-    element["value"] = data
-    recvbytes.pop(0)
-    recvbytes.pop(0)
+    return chr(value)
 
 
-def get_dint(recvbytes, element):
+def get_string(encoding="latin-1"):
     """
-    read datatype from 4 byte
-    -2.147.483.648 to +2.147.483.647
+    create converter to read datatype from max 256 byte
+    first byte of string = maximal length of string
+    second byte of string = actual length of string
+    other bytes of string = Characters (max 254 chars) in the given encoding
+    the actual length is limited to the maximal length and the size of the data
     """
-    data = str(struct.unpack('!i', bytes(recvbytes[0:4]))[0])
-    element["value"] = data
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
+    def get_chars(value):
+        length = min(value[0], value[1])
+        return value[2:2 + length].decode(encoding, "replace")
+    return get_chars
 
 
-def get_udint(recvbytes, element):
+def get_wstring(encoding="utf-16-be"):
     """
-    read datatype from 4 byte
-    0 bis 4.294.967.295
+    create converter to read datatype from max 32.768 byte
+    first 2 byte of wstring = maximal length of wstring
+    second 2 byte of wstring = actual length of wstring
+    other bytes of wstring = Unicode-Characters (max 16382 wchars) in the given encoding
+    the actual length is limited to the maximal length and the size of the data
     """
-    data = str(struct.unpack('!I', bytes(recvbytes[0:4]))[0])
-    element["value"] = data
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
+    def get_wchars(value):
+        length = min((value[0] << 8) | value[1], (value[2] << 8) | value[3]) * 2  # 10 wchars = 20 bytes
+        return value[4:4 + length].decode(encoding, "replace")
+    return get_wchars
 
 
-def get_lint(recvbytes, element):
-    """
-    read datatype from 8 byte
-    -9.223.372.036.854.775.808 bis +9.223.372.036.854.775.807
+def get_dtl(year, month, day, weekday, hour, minute, second, nanosecond):
     """
-    data = str(struct.unpack('!q', bytes(recvbytes[0:8]))[0])
-    element["value"] = data
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-
-
-def get_ulint(recvbytes, element):
+    convert the values of a DTL to datetime (nanoseconds are cut to microseconds)
+    return None if the DTL holds no valid date (sample: not initialised in the PLC)
     """
-    read datatype from 8 byte
-    0 bis 18.446.744.073.709.551.615
-    """
-    data = str(struct.unpack('!Q', bytes(recvbytes[0:8]))[0])
-    element["value"] = data
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-
-
-def get_real(recvbytes, element):
-    """
-    read datatype from 4 byte
-    -3.402823E+38 to -1.175495E-38
-    ±0,0
-    +1.175495E-38 to +3.402823E+38
-    """
-    data = str(struct.unpack('!f', bytes(recvbytes[0:4]))[0])
-    element["value"] = data
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
+    try:
+        return datetime.datetime(year, month, day, hour, minute, second, nanosecond // 1000)
+    except ValueError:
+        return None
 
 
-def get_lreal(recvbytes, element):
-    """
-    read datatype from 8 byte
-    -1.7976931348623157e+308 to -2.2250738585072014e-308
-    ±0,0
-    +2.2250738585072014e-308 to +1.7976931348623157e+308
-    """
-    data = str(struct.unpack('!d', bytes(recvbytes[0:8]))[0])
-    element["value"] = data
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-
-
-def get_char(recvbytes, element):
+def get_dtl_text(value):
     """
-    read datatype from 1 byte
-    ASCII-Character
+    format datetime of a DTL like TIA Portal
+    sample: datetime(2021, 5, 14, 12, 30, 45, 123456) --> "DTL#2021-05-14-12:30:45.123456"
     """
-    data = str(chr(recvbytes[0]))
-    element["value"] = data
-    recvbytes.pop(0)
+    return "DTL#{value:%Y-%m-%d-%H:%M:%S.%f}".format(value=value)
 
 
-def get_wchar(recvbytes, element):
+def get_bool(bit):
     """
-    read datatype from 2 byte
-    Unicode-Character
+    create converter to read one bit of the unpacked byte
+    FALSE or TRUE / 0 or 1
     """
-    data = str(chr(struct.unpack('!h', bytes(recvbytes[0:2]))[0]))
-    element["value"] = data
-    recvbytes.pop(0)
-    recvbytes.pop(0)
+    bitmask = 1 << bit
+
+    def get_bit(value):
+        return (value & bitmask) != 0
+    return get_bit
+
+
+# define converter of the unpacked values
+# all other datatypes are unpacked to their native value (int or float)
+# SInt: -128 to +127
+# USInt: 0 to 255
+# Int: -32.768 to +32.767
+# UInt: 0 to 65.535
+# DInt: -2.147.483.648 to +2.147.483.647
+# UDInt: 0 to 4.294.967.295
+# LInt: -9.223.372.036.854.775.808 to +9.223.372.036.854.775.807
+# ULInt: 0 to 18.446.744.073.709.551.615
+# Real: -3.402823E+38 to +3.402823E+38
+# LReal: -1.7976931348623157e+308 to +1.7976931348623157e+308
+converters = {"Char": get_char,
+              "WChar": get_char}
+
+# define text format of the values
+# all other datatypes are shown with str()
+textformats = {"Byte": get_hex(1),
+               "Word": get_hex(2),
+               "DWord": get_hex(2),
+               "LWord": get_hex(6),
+               "DTL": get_dtl_text}
 
 
-def get_string(recvbytes, element):
+def get_field(element, encodings=(string_encoding, wstring_encoding)):
     """
-    read datatype from max 256 byte
-    first byte of string = maximal length of string
-    second byte of string = actual length of string
-    other bytes of string = ASCII-Characters (max 254 chars)
+    get struct format, size in bytes and converter of an element
+    return None if the element holds no data (markers, declaration lines and offsets)
+    encodings: encoding of String and WString
+    sample: {"datatype": "Int", "byte": "10.0", ...} --> "h", 2, None
+    sample: {"datatype": "String[10]", "byte": "12.0", "size": 12, ...} --> "12s", 12, get_chars
     """
-    size = recvbytes[0]
-    length = recvbytes[1]
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    data = ""
-    for char in range(length):
-        data += str(chr(recvbytes[char]))
-    element["value"] = data
-    for byte in range(size):
-        recvbytes.pop(0)
-
-
-def get_wstring(recvbytes, element):
+    datatype = element["datatype"]
+    if element["action"] == "offset":
+        return None
+    if datatype == "Bool":
+        byte, bit = get_address(element)
+        return "B", 1, get_bool(bit)
+    if datatype in formats:
+        return formats[datatype], struct.calcsize(formats[datatype]), converters.get(datatype)
+    if datatype[:6] == "String":
+        size = int(element["size"])
+        return "{size}s".format(size=size), size, get_string(encodings[0])
+    if datatype[:7] == "WString":
+        size = int(element["size"])
+        return "{size}s".format(size=size), size, get_wstring(encodings[1])
+    return None
+
+
+class BitSet(object):
+    def __init__(self, data=b"", length=0):
+        """
+        read only view on packed bools (bit 0 of the first byte = first bool)
+        the bits are read on request, no python object is created per bit
+        """
+        self.data = data
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, bit):
+        if bit < 0:
+            bit += self.length
+        if not 0 <= bit < self.length:
+            raise IndexError("BitSet index out of range")
+        return (self.data[bit >> 3] >> (bit & 7)) & 1 == 1
+
+    def __iter__(self):
+        return islice(chain.from_iterable(map(bytebits.__getitem__, self.data)), self.length)
+
+    def integer(self):
+        """
+        return all bits as one integer (bit 0 = first bool)
+        """
+        return int.from_bytes(self.data, "little") & ((1 << self.length) - 1)
+
+    def count(self):
+        """
+        return number of bools that are True
+        """
+        return bin(self.integer()).count("1")
+
+    def any(self):
+        """
+        return True if any bool is True
+        """
+        return self.integer() != 0
+
+    def indexes(self):
+        """
+        return the positions of all bools that are True
+        """
+        bits = self.integer()
+        result = []
+        while bits:
+            lowest = bits & -bits
+            result.append(lowest.bit_length() - 1)
+            bits ^= lowest
+        return result
+
+
+class BitField(object):
+    def __init__(self, first, length, byte):
+        """
+        bools in a row (sample: Array[0..4095] of Bool) that are read together
+        first: index of the first bool in datastructure, the others follow without gaps
+        byte: byteaddress of the first bool (bit 0), the others follow bit by bit
+        """
+        self.first = first
+        self.length = length
+        self.byte = byte
+        self.size = (length + 7) // 8
+        self.indexes = range(first, first + length)
+        self.data = bytes(self.size)
+
+    def decode(self, data, values):
+        """
+        extract all bits of the raw bytes with the precomputed bit table and save them in values
+        """
+        self.data = data
+        values[self.first:self.first + self.length] = islice(chain.from_iterable(map(bytebits.__getitem__, data)),
+                                                             self.length)
+
+    def update(self, data, values):
+        """
+        compare raw bytes with the last raw bytes, update only the changed bits
+        return set of indexes of the changed bools
+        """
+        bits = (int.from_bytes(data, "little") ^ int.from_bytes(self.data, "little")) & ((1 << self.length) - 1)
+        self.data = data
+        changed = set()
+        while bits:
+            lowest = bits & -bits
+            bit = lowest.bit_length() - 1
+            values[self.first + bit] = bytebits[data[bit >> 3]][bit & 7]
+            changed.add(self.first + bit)
+            bits ^= lowest
+        return changed
+
+    def numpy_format(self):
+        """
+        numpy format of the bitfield for batch decoding
+        """
+        return "({size},)u1".format(size=self.size)
+
+    def decode_batch(self, column):
+        """
+        extract the bits of a numpy column (one row of raw bytes per frame) with unpackbits
+        return {index: numpy array of bool}
+        """
+        numpy = get_numpy()
+        bits = numpy.unpackbits(column, axis=1, bitorder="little").astype(bool)
+        return {self.first + bit: bits[:, bit] for bit in range(self.length)}
+
+    def bits(self):
+        """
+        return the bools of the last frame as BitSet
+        """
+        return BitSet(self.data, self.length)
+
+
+class StructArray(object):
+    def __init__(self, bases, byte, stride, itemstruct, itemfields):
+        """
+        array of struct or UDT (sample: Array[0..999] of "Axis") whose items have the same layout
+        bases: index of the first element with data of every item in datastructure
+        byte: byteaddress of the first item
+        stride: distance of the byteaddresses of two following items
+        itemstruct: struct of one item (size = stride), used for single changed items
+        itemfields: [(index in item, position in the unpacked item, converter, column converter)]
+        """
+        self.bases = bases
+        self.first = bases[0]
+        self.count = len(bases)
+        # distance of the indexes of two following items, None if the items are not equally spaced
+        # (multidimensional arrays have markers between the dimensions)
+        self.step = None
+        if self.count > 1 and bases == list(range(bases[0], bases[-1] + 1, bases[1] - bases[0])):
+            self.step = bases[1] - bases[0]
+        self.byte = byte
+        self.stride = stride
+        self.size = self.count * stride
+        self.itemstruct = itemstruct
+        self.itemfields = itemfields
+        # struct of all items, the fields of one item repeat every fieldcount values
+        self.arraystruct = struct.Struct(">" + itemstruct.format.lstrip("><!=@") * self.count)
+        self.fieldcount = len(itemstruct.unpack(bytes(stride)))
+        self.indexes = [base + field[0] for base in bases for field in itemfields]
+        self.data = bytes(self.size)
+
+    def decode(self, data, values):
+        """
+        unpack all items at once, every column is a strided view of the unpacked values
+        every column is converted at once and saved in values with one slice assignment
+        """
+        self.data = data
+        unpacked = self.arraystruct.unpack(data)
+        fieldcount = self.fieldcount
+        for offset, position, converter, columnconverter in self.itemfields:
+            column = unpacked[position::fieldcount]
+            if columnconverter is not None:
+                column = columnconverter(column)
+            if self.step is not None:
+                values[self.first + offset:self.first + offset + self.count * self.step:self.step] = column
+            else:
+                for base, value in zip(self.bases, column):
+                    values[base + offset] = value
+
+    def update(self, data, values):
+        """
+        compare raw bytes of every item with the last raw bytes, unpack only the changed items
+        return set of indexes of the changed elements
+        """
+        previous = self.data
+        self.data = data
+        changed = set()
+        stride = self.stride
+        for item, base in enumerate(self.bases):
+            start = item * stride
+            if data[start:start + stride] == previous[start:start + stride]:
+                continue
+            unpacked = self.itemstruct.unpack_from(data, start)
+            for offset, position, converter, columnconverter in self.itemfields:
+                value = unpacked[position]
+                if converter is not None:
+                    value = converter(value)
+                last = values[base + offset]
+                # NaN (Real, LReal) is not changed by another NaN
+                if last != value and (value == value or last == last):
+                    values[base + offset] = value
+                    changed.add(base + offset)
+        return changed
+
+    def numpy_format(self):
+        """
+        items are decoded element by element in batches
+        """
+        return None
+
+    def column(self, index, values):
+        """
+        return the values of one field in all items (sample: index of "axes.[3].Speed" --> Speed of all axes)
+        """
+        offset = index - self.bases[bisect_right(self.bases, index) - 1]
+        return [values[base + offset] for base in self.bases]
+
+
+class DateTime(object):
+    def __init__(self, index, byte):
+        """
+        DTL read with one struct call: the 8 values and a datetime of all values
+        index: index of the DTL declaration in datastructure, the 8 values follow without gaps
+        byte: byteaddress of the DTL (12 bytes)
+        """
+        self.index = index
+        self.first = index + 1
+        self.byte = byte
+        self.size = dtl_struct.size
+        self.indexes = [index] + list(range(self.first, self.first + 8))
+        self.data = bytes(self.size)
+
+    def decode(self, data, values):
+        """
+        unpack the values of the DTL and convert them to datetime
+        """
+        self.data = data
+        unpacked = dtl_struct.unpack(data)
+        values[self.first:self.first + 8] = unpacked
+        values[self.index] = get_dtl(*unpacked)
+
+    def update(self, data, values):
+        """
+        decode the DTL if its bytes changed
+        return set of indexes of the changed values
+        """
+        if data == self.data:
+            return set()
+        previous = values[self.index:self.first + 8]
+        self.decode(data, values)
+        return set(index for index, value in zip(self.indexes, previous) if values[index] != value)
+
+    def numpy_format(self):
+        """
+        numpy format of the DTL for batch decoding (the 8 values)
+        """
+        return dtl_fields
+
+    def decode_batch(self, column):
+        """
+        take the values of the DTL of every frame from the columns of its fields
+        the datetimes are calculated for all frames at once with datetime64
+        return {index: numpy array}, the DTL declaration gets an array of datetime (None if not valid)
+        """
+        numpy = get_numpy()
+        columns = {}
+        for index, (name, fieldformat) in zip(range(self.first, self.first + 8), dtl_fields):
+            columns[index] = column[name].astype(column[name].dtype.newbyteorder("="))
+        year, month, day, weekday, hour, minute, second, nanosecond = (column[name].astype("int64")
+                                                                       for name, fieldformat in dtl_fields)
+        months = ((year - 1970) * 12 + month - 1).astype("datetime64[M]")
+        moments = (months.astype("datetime64[D]") + (day - 1).astype("timedelta64[D]")).astype("datetime64[us]")
+        moments = (moments + (hour * 3600 + minute * 60 + second).astype("timedelta64[s]") +
+                   (nanosecond // 1000).astype("timedelta64[us]"))
+        # values datetime does not take (like get_dtl), days after the end of the month
+        valid = ((year >= 1) & (year <= 9999) & (month >= 1) & (month <= 12) & (day >= 1) & (hour < 24) &
+                 (minute < 60) & (second < 60) & (nanosecond < 1000000000) &
+                 (moments.astype("datetime64[M]") == months))
+        datetimes = numpy.full(len(column), None, dtype=object)
+        datetimes[valid] = moments[valid].astype(object)
+        columns[self.index] = datetimes
+        return columns
+
+    def nanoseconds(self, values):
+        """
+        return the DTL as nanoseconds since 1970-01-01 (time of the PLC, no timezone)
+        return None if the DTL holds no valid date
+        """
+        value = values[self.index]
+        if value is None:
+            return None
+        seconds = (value.replace(microsecond=0) - epoch) // datetime.timedelta(seconds=1)
+        return seconds * 1000000000 + values[self.first + 7]
+
+
+def get_column(element, encodings=(string_encoding, wstring_encoding)):
     """
-    read datatype from max 32.768 byte
-    first 2 byte of wstring = maximal length of wstring
-    second 2 byte of wstring = actual length of wstring
-    other bytes of wstring = Unicode-Characters (max 16382 wchars)
+    create converter of a whole column (values of one field in all items of an array of struct or UDT)
+    bools are read with a table of the bit in every possible byte, strings in one loop without function calls
+    return None if the unpacked values are used as they are
     """
-    size = struct.unpack('!H', bytes(recvbytes[0:2]))[0]
-    size = size * 2  # 10 wchars = 20 bytes
-    length = struct.unpack('!H', bytes(recvbytes[2:4]))[0]
-    length = length * 2  # 10 wchars = 20 bytes
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    recvbytes.pop(0)
-    data = ""
-    for wchar in range(0, length, 2):
-        data += str(chr(struct.unpack('!h', bytes(recvbytes[wchar:wchar+2]))[0]))
-    element["value"] = data
-    for wchar in range(size):
-        recvbytes.pop(0)
-
-
-def get_plc_data(receivedbytes, datastructure):
+    datatype = element["datatype"]
+    if datatype == "Bool":
+        byte, bit = get_address(element)
+        bittable = tuple(bits[bit] for bits in bytebits)
+
+        def get_bits(column):
+            return list(map(bittable.__getitem__, column))
+        return get_bits
+    if datatype[:6] == "String":
+        encoding = encodings[0]
+
+        def get_strings(column):
+            return [value[2:2 + min(value[0], value[1])].decode(encoding, "replace") for value in column]
+        return get_strings
+    if datatype[:7] == "WString":
+        encoding = encodings[1]
+
+        def get_wstrings(column):
+            return [value[4:4 + min((value[0] << 8) | value[1], (value[2] << 8) | value[3]) * 2].decode(
+                encoding, "replace") for value in column]
+        return get_wstrings
+    converter = converters.get(datatype)
+    if converter is None:
+        return None
+
+    def get_converted(column):
+        return list(map(converter, column))
+    return get_converted
+
+
+def get_array_count(datatype):
     """
-    for every data in datastructure read its values from receivedbytes
+    get number of items and datatype of the items of an array
+    sample: 'Array[0..3, 1..2] of "Axis"' --> 8, '"Axis"'
+    return None, None if datatype is no array
     """
-    recvbytes = receivedbytes[:]
-    for element in datastructure:
-        datatype = element["datatype"]
-        if datatype == "Bool":
-            get_bool(recvbytes=recvbytes, element=element)
-        elif datatype == "Byte":
-            get_byte(recvbytes=recvbytes, element=element)
-        elif datatype == "Word":
-            get_word(recvbytes=recvbytes, element=element)
-        elif datatype == "DWord":
-            get_dword(recvbytes=recvbytes, element=element)
-        elif datatype == "LWord":
-            get_lword(recvbytes=recvbytes, element=element)
-        elif datatype == "SInt":
-            get_sint(recvbytes=recvbytes, element=element)
-        elif datatype == "USInt":
-            get_usint(recvbytes=recvbytes, element=element)
-        elif datatype == "Int":
-            get_int(recvbytes=recvbytes, element=element)
-        elif datatype == "UInt":
-            get_uint(recvbytes=recvbytes, element=element)
-        elif datatype == "DInt":
-            get_dint(recvbytes=recvbytes, element=element)
-        elif datatype == "UDInt":
-            get_udint(recvbytes=recvbytes, element=element)
-        elif datatype == "LInt":
-            get_lint(recvbytes=recvbytes, element=element)
-        elif datatype == "ULInt":
-            get_ulint(recvbytes=recvbytes, element=element)
-        elif datatype == "Real":
-            get_real(recvbytes=recvbytes, element=element)
-        elif datatype == "LReal":
-            get_lreal(recvbytes=recvbytes, element=element)
-        elif datatype == "Char":
-            get_char(recvbytes=recvbytes, element=element)
-        elif datatype == "WChar":
-            get_wchar(recvbytes=recvbytes, element=element)
-        elif datatype[:6] == "String":
-            get_string(recvbytes=recvbytes, element=element)
-        elif datatype[:7] == "WString":
-            get_wstring(recvbytes=recvbytes, element=element)
+    regex = re.match(r"^Array\[(.+)\] of (.+)$", datatype)
+    if regex is None:
+        return None, None
+    count = 1
+    for dimension in regex.group(1).split(","):
+        start, end = dimension.split("..")
+        count *= int(end) - int(start) + 1
+    return count, regex.group(2).strip()
+
+
+class Decoder(object):
+    def __init__(self, datastructure, encodings=(string_encoding, wstring_encoding)):
+        """
+        compile datastructure once into an offset table and one struct format
+        every byteaddress is unpacked once per frame, bools of the same byte share one field
+        bools in a row (Array of Bool) are read together as bitfield and extracted with a bit table
+        arrays of struct or UDT are unpacked item by item with one struct and saved column by column
+        DTL are read with one struct call and saved as datetime in the DTL declaration
+        gaps between the fields (offsets) are skipped with pad bytes
+        the decoded values are saved in a list parallel to the datastructure
+        consumers can subscribe to the elements they need, then only those are decoded
+        encodings: encoding of String and WString
+        """
+        self.datastructure = datastructure
+        self.encodings = tuple(encodings)
+        self.values = [None] * len(datastructure)
+        self.textformats = [textformats.get(element["datatype"], str) for element in datastructure]
+        # offset table of all elements with data {index: (byte, format, size, converter)}
+        self.table = {}
+        # groups of elements that are decoded together (bitfields) and the group of every grouped element
+        self.groups = []
+        self.groupof = {}
+        self.tabulate()
+        # subscribed elements of every consumer {consumer: frozenset(indexes)}
+        self.subscriptions = {}
+        self.struct = None
+        self.size = 0
+        self.selection = []
+        self.fields = []
+        self.blocks = {}
+        self.previous = None
+        self.direct = []
+        self.direct_indexes = []
+        self.direct_get = None
+        self.converted = []
+        self.grouped = []
+        self.compile()
+
+    def tabulate(self):
+        """
+        create offset table of all elements with data {index: (byte, format, size, converter)}
+        """
+        self.table = {}
+        for index, element in enumerate(self.datastructure):
+            field = get_field(element, self.encodings)
+            if field is not None:
+                fieldformat, size, converter = field
+                byte, bit = get_address(element)
+                self.table[index] = (byte, fieldformat, size, converter)
+        self.groups = []
+        self.groupof = {}
+        self.tabulate_datetimes()
+        self.tabulate_structarrays()
+        self.tabulate_bitfields()
+
+    def tabulate_datetimes(self):
+        """
+        search DTL declarations, the 8 values of the DTL are read as one DateTime
+        """
+        for index, element in enumerate(self.datastructure):
+            if element["datatype"] != "DTL" or element["action"] != "open":
+                continue
+            values = list(range(index + 1, index + 9))
+            if not all(value in self.table for value in values):
+                continue
+            byte = self.table[index + 1][0]
+            if [self.table[value][0] for value in values] != [byte, byte + 2, byte + 3, byte + 4, byte + 5,
+                                                               byte + 6, byte + 7, byte + 8]:
+                continue
+            datetime_group = DateTime(index=index, byte=byte)
+            for value in datetime_group.indexes:
+                self.groupof[value] = datetime_group
+            self.groups.append(datetime_group)
+
+    def tabulate_structarrays(self):
+        """
+        search arrays of struct or UDT whose items have the same layout in a constant distance
+        the elements of every item must follow in the same order with the same datatypes
+        """
+        end = 0
+        for index, element in enumerate(self.datastructure):
+            if index < end or element["action"] != "open":
+                continue
+            count, itemtype = get_array_count(element["datatype"])
+            if count is None or count < structarray_minsize:
+                continue
+            if not (itemtype == "Struct" or itemtype.startswith('"')):
+                continue
+            # search end of array
+            depth = 1
+            end = index + 1
+            while end < len(self.datastructure) and depth > 0:
+                if self.datastructure[end]["datatype"] == "START_ARRAY":
+                    depth += 1
+                elif self.datastructure[end]["datatype"] == "END_ARRAY":
+                    depth -= 1
+                end += 1
+            indexes = [data for data in range(index, end) if data in self.table]
+            if any(data in self.groupof for data in indexes):
+                continue
+            structarray = self.get_structarray(indexes=indexes, count=count)
+            if structarray is not None:
+                for data in structarray.indexes:
+                    self.groupof[data] = structarray
+                self.groups.append(structarray)
+
+    def get_structarray(self, indexes, count):
+        """
+        create StructArray of the elements with data of an array
+        return None if the items do not have the same layout or share bytes with other elements
+        """
+        if not indexes or len(indexes) % count != 0:
+            return None
+        length = len(indexes) // count
+        items = [indexes[item * length:(item + 1) * length] for item in range(count)]
+        byte = self.table[items[0][0]][0]
+        stride = self.table[items[1][0]][0] - byte
+        if stride <= 0:
+            return None
+        for item, itemindexes in enumerate(items):
+            for first, index in zip(items[0], itemindexes):
+                firstbyte, firstbit = get_address(self.datastructure[first])
+                if index - itemindexes[0] != first - items[0][0]:
+                    return None
+                if self.datastructure[index]["datatype"] != self.datastructure[first]["datatype"]:
+                    return None
+                if get_address(self.datastructure[index]) != (firstbyte + item * stride, firstbit):
+                    return None
+        # struct of one item, bools of the same byte share one field
+        fields = {}
+        for index in items[0]:
+            fieldbyte, fieldformat, size, converter = self.table[index]
+            fields.setdefault(fieldbyte - byte, (fieldformat, size))
+        itemformat = ">"
+        address = 0
+        positions = {}
+        for position, fieldbyte in enumerate(sorted(fields)):
+            fieldformat, size = fields[fieldbyte]
+            if fieldbyte < address:
+                return None
+            if fieldbyte > address:
+                itemformat += "{gap}x".format(gap=fieldbyte - address)
+            itemformat += fieldformat
+            positions[fieldbyte] = position
+            address = fieldbyte + size
+        if address > stride:
+            return None
+        if address < stride:
+            itemformat += "{gap}x".format(gap=stride - address)
+        itemfields = [(index - items[0][0], positions[self.table[index][0] - byte], self.table[index][3],
+                       get_column(self.datastructure[index], self.encodings)) for index in items[0]]
+        structarray = StructArray(bases=[itemindexes[0] for itemindexes in items], byte=byte, stride=stride,
+                                  itemstruct=struct.Struct(itemformat), itemfields=itemfields)
+        # the array must not share bytes with other elements
+        grouped = set(indexes)
+        for index in self.table:
+            if index not in grouped and byte <= self.table[index][0] < byte + structarray.size:
+                return None
+        return structarray
+
+    def tabulate_bitfields(self):
+        """
+        search bools in a row (following indexes and following bits, starting at bit 0)
+        at least bitfield_minsize bools in a row are read together as one bitfield
+        """
+        runs = []
+        run = []
+        for index, element in enumerate(self.datastructure):
+            if index in self.table and index not in self.groupof and element["datatype"] == "Bool":
+                byte, bit = get_address(element)
+                if run and index == run[-1][0] + 1 and byte * 8 + bit == run[-1][1] + 1:
+                    run.append((index, byte * 8 + bit))
+                    continue
+                runs.append(run)
+                run = [(index, byte * 8 + bit)] if bit == 0 else []
+            else:
+                runs.append(run)
+                run = []
+        runs.append(run)
+        bitfields = [BitField(first=run[0][0], length=len(run), byte=run[0][1] // 8)
+                     for run in runs if len(run) >= bitfield_minsize]
+        # bitfields must not share bytes with other elements
+        grouped = set(index for bitfield in bitfields for index in bitfield.indexes)
+        used = set(self.table[index][0] for index in self.table if index not in grouped)
+        used.update(byte for group in self.groups for byte in range(group.byte, group.byte + group.size))
+        for bitfield in bitfields:
+            if used.isdisjoint(range(bitfield.byte, bitfield.byte + bitfield.size)):
+                for index in bitfield.indexes:
+                    self.groupof[index] = bitfield
+                self.groups.append(bitfield)
+
+    def compile(self):
+        """
+        create struct format of the selected elements in order of their byteaddresses
+        selected are all elements or (if there are subscriptions) the subscribed elements
+        not selected data is skipped with pad bytes, so decoding jumps directly to the selected offsets
+        """
+        if self.subscriptions:
+            selection = set().union(*self.subscriptions.values())
+            indexes = sorted(index for index in selection if index in self.table or index in self.groupof)
         else:
-            pass
+            indexes = sorted(self.table)
+        # collect fields {byte: (format, size, group)}, grouped elements share one field of raw bytes
+        fields = {}
+        for index in indexes:
+            group = self.groupof.get(index)
+            if group is None:
+                byte, fieldformat, size, converter = self.table[index]
+                fields.setdefault(byte, (fieldformat, size, None))
+            elif group.byte not in fields:
+                fields[group.byte] = ("{size}s".format(size=group.size), group.size, group)
+        structformat = ">"
+        address = 0
+        positions = {}  # {byte: position of the field in the unpacked values}
+        for position, byte in enumerate(sorted(fields)):
+            fieldformat, size, group = fields[byte]
+            if byte < address:
+                raise ValueError("Dataerror: Data overlaps at byte {byte}".format(byte=byte))
+            if byte > address:
+                structformat += "{gap}x".format(gap=byte - address)
+            structformat += fieldformat
+            positions[byte] = position
+            address = byte + size
+        self.struct = struct.Struct(structformat)
+        self.size = self.struct.size
+        # elements that are decoded one by one and groups that are decoded together
+        plain = [index for index in indexes if index not in self.groupof]
+        groups = [fields[byte][2] for byte in sorted(fields) if fields[byte][2] is not None]
+        self.selection = sorted(plain + [index for group in groups for index in group.indexes])
+        # single fields for delta decoding [(byte, size, struct, [(index, converter)], group)]
+        self.fields = []
+        for byte in sorted(fields):
+            fieldformat, size, group = fields[byte]
+            self.fields.append((byte, size, struct.Struct(">" + fieldformat), [], group))
+        for index in plain:
+            byte, fieldformat, size, converter = self.table[index]
+            self.fields[positions[byte]][3].append((index, converter))
+        # fields in every byte range {block: [position of field]}
+        self.blocks = {}
+        for position, (byte, size, fieldstruct, elements, group) in enumerate(self.fields):
+            for block in range(byte // delta_blocksize, (byte + size - 1) // delta_blocksize + 1):
+                self.blocks.setdefault(block, []).append(position)
+        # the next frame is decoded completely
+        self.previous = None
+        # values that are used as unpacked (int, float) are copied with one itemgetter
+        self.direct = [(index, positions[self.table[index][0]]) for index in plain if self.table[index][3] is None]
+        self.direct_indexes = [index for index, position in self.direct]
+        self.direct_get = itemgetter(*[position for index, position in self.direct] or [0])
+        # values that need a conversion (bool, char, string)
+        self.converted = [(index, positions[self.table[index][0]], self.table[index][3])
+                          for index in plain if self.table[index][3] is not None]
+        # groups with the position of their raw bytes
+        self.grouped = [(group, positions[group.byte]) for group in groups]
+
+    def set_encodings(self, encodings):
+        """
+        change the encoding of String and WString
+        sample: ("cp1252", "utf-16-be")
+        """
+        encodings = tuple(encodings)
+        if encodings != self.encodings:
+            self.encodings = encodings
+            self.tabulate()
+            self.compile()
+
+    def subscribe(self, consumer, indexes):
+        """
+        set the elements a consumer (csv, datatree, ...) needs
+        the struct format is compiled again only if the subscription changed
+        """
+        indexes = frozenset(indexes)
+        if self.subscriptions.get(consumer) != indexes:
+            self.subscriptions[consumer] = indexes
+            self.compile()
+
+    def unsubscribe(self, consumer):
+        """
+        delete the subscription of a consumer
+        without any subscription all elements are decoded
+        """
+        if consumer in self.subscriptions:
+            del self.subscriptions[consumer]
+            self.compile()
+
+    def decode(self, receivedbytes):
+        """
+        unpack all selected fields of one frame in one pass
+        save the native values in the value list and return it
+        """
+        if isinstance(receivedbytes, list):
+            receivedbytes = bytes(receivedbytes)
+        self.previous = None
+        values = self.values
+        unpacked = self.struct.unpack_from(memoryview(receivedbytes))
+        if len(self.direct) == 1:
+            values[self.direct_indexes[0]] = self.direct_get(unpacked)
+        elif self.direct:
+            for index, value in zip(self.direct_indexes, self.direct_get(unpacked)):
+                values[index] = value
+        for index, position, converter in self.converted:
+            values[index] = converter(unpacked[position])
+        for group, position in self.grouped:
+            group.decode(unpacked[position], values)
+        return values
+
+    def update(self, receivedbytes):
+        """
+        decode one frame by comparing it with the last frame
+        compare both frames in byte ranges, decode only the fields whose bytes changed
+        return the set of indexes of the elements whose value changed
+        the first frame (and the first frame after the subscriptions changed) is decoded completely
+        """
+        frame = bytes(receivedbytes)
+        previous = self.previous
+        if previous is None or len(previous) != len(frame):
+            self.decode(frame)
+            self.previous = frame
+            return set(self.selection)
+        self.previous = frame
+        if frame == previous:
+            return set()
+        # search the byte ranges with differences
+        positions = set()
+        for block, fields in self.blocks.items():
+            start = block * delta_blocksize
+            end = start + delta_blocksize
+            if frame[start:end] != previous[start:end]:
+                positions.update(fields)
+        # decode the changed fields
+        changed = set()
+        values = self.values
+        for position in positions:
+            byte, size, fieldstruct, elements, group = self.fields[position]
+            if frame[byte:byte + size] == previous[byte:byte + size]:
+                continue
+            if group is not None:
+                changed.update(group.update(frame[byte:byte + size], values))
+                continue
+            unpacked = fieldstruct.unpack_from(frame, byte)[0]
+            for index, converter in elements:
+                value = unpacked if converter is None else converter(unpacked)
+                # NaN (Real, LReal) is not changed by another NaN
+                if value != values[index] and (value == value or values[index] == values[index]):
+                    values[index] = value
+                    changed.add(index)
+        return changed
+
+    def batch_fields(self):
+        """
+        get the fields of the selected elements for batch decoding
+        return [(byte, numpy format, [(index, converter)], group)] in order of the byteaddresses
+        bools of the same byte share one field (unsigned byte), bitfields are read as array of bytes
+        strings are read as raw bytes
+        """
+        fields = {}
+        for index in self.selection:
+            group = self.groupof.get(index)
+            if group is not None and group.numpy_format() is not None:
+                fields.setdefault(group.byte, (group.numpy_format(), [], group))
+                continue
+            if index not in self.table:
+                continue
+            byte, fieldformat, size, converter = self.table[index]
+            datatype = self.datastructure[index]["datatype"]
+            numpyformat = numpy_formats.get(datatype, "V{size}".format(size=size))
+            fields.setdefault(byte, (numpyformat, [], None))[1].append((index, converter))
+        return [(byte, ) + fields[byte] for byte in sorted(fields)]
+
+    def dtype(self, framesize=None):
+        """
+        create a numpy structured dtype of the selected fields
+        every field is placed at its byteaddress, offsets and not selected data are skipped
+        """
+        numpy = get_numpy()
+        if framesize is None:
+            framesize = self.size
+        names = []
+        fieldformats = []
+        offsets = []
+        for byte, numpyformat, elements, group in self.batch_fields():
+            names.append("byte_{byte}".format(byte=byte))
+            fieldformats.append(numpyformat)
+            offsets.append(byte)
+        return numpy.dtype({"names": names, "formats": fieldformats, "offsets": offsets, "itemsize": framesize})
+
+    def decode_batch(self, frames, framesize=None):
+        """
+        decode many frames at once with numpy
+        frames: list of frames (same size) or one bytestring with all frames in a row
+        framesize: number of bytes of one frame (udt_datasize), needed for one bytestring
+        return the columns of the selected elements {index: numpy array with one value per frame}
+        bools are extracted from their bytes with bit operations on the whole column
+        chars and strings are returned as array of python strings
+        """
+        numpy = get_numpy()
+        if isinstance(frames, (list, tuple)):
+            if framesize is None:
+                framesize = len(frames[0]) if frames else self.size
+            frames = b"".join(bytes(frame) for frame in frames)
+        if framesize is None:
+            # the compiled struct ends with the last selected field, not with the frame
+            raise ValueError("framesize is needed to decode frames of one bytestring")
+        if framesize < self.size or len(frames) % framesize != 0:
+            raise ValueError("{size} bytes are no frames of {framesize} bytes".format(size=len(frames),
+                                                                                    framesize=framesize))
+        dtype = self.dtype(framesize)
+        rows = numpy.frombuffer(frames, dtype=dtype, count=len(frames) // dtype.itemsize)
+        columns = {}
+        for byte, numpyformat, elements, group in self.batch_fields():
+            column = rows["byte_{byte}".format(byte=byte)]
+            if group is not None:
+                columns.update(group.decode_batch(column))
+                continue
+            for index, converter in elements:
+                datatype = self.datastructure[index]["datatype"]
+                if datatype == "Bool":
+                    bitbyte, bit = get_address(self.datastructure[index])
+                    columns[index] = ((column >> bit) & 1).astype(bool)
+                elif converter is not None:
+                    columns[index] = numpy.array([converter(value.item()) for value in column], dtype=object)
+                else:
+                    columns[index] = column.astype(column.dtype.newbyteorder("="))
+        return columns
+
+    def bits(self, index):
+        """
+        return the bools of the bitfield that contains the element as BitSet
+        sample: index of "alarms.[0]" --> BitSet of all bools in Array[0..4095] of Bool
+        return None if the element is not part of a bitfield
+        """
+        group = self.groupof.get(index)
+        if isinstance(group, BitField):
+            return group.bits()
+        return None
+
+    def column(self, index):
+        """
+        return the values of one field in all items of the array of struct or UDT that contains the element
+        sample: index of "axes.[0].Speed" --> [Speed of axes.[0], Speed of axes.[1], ...]
+        return None if the element is not part of an array of struct or UDT
+        """
+        group = self.groupof.get(index)
+        if isinstance(group, StructArray):
+            return group.column(index, self.values)
+        return None
+
+    def timestamp(self, index):
+        """
+        return the DTL as nanoseconds since 1970-01-01 (sample: for ordering of rows at high frame rates)
+        index: index of the DTL declaration in datastructure
+        return None if the element is no DTL or holds no valid date
+        """
+        group = self.groupof.get(index)
+        if isinstance(group, DateTime):
+            return group.nanoseconds(self.values)
+        return None
+
+    def text(self, index):
+        """
+        return the value of an element as text
+        """
+        value = self.values[index]
+        if value is None:
+            return ""
+        return self.textformats[index](value)
@@ -0,0 +1,487 @@
+"""
+ConPlc - connect PLC and PC
+Copyright (C) 2021  Marvin Mangold (Marvin.Mangold00@googlemail.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import json
+import collections
+from operator import itemgetter
+import readplc
+import csvhandler
+import aggregate
+import tcpserver
+
+
+# csv settings of a job, the row plan is compiled again only if one of them (or the rows) changed
+setting_keys = ("csv_active", "csv_filename", "csv_filepath", "csv_filemode", "csv_triggermode", "csv_time",
+                "csv_delimiter", "csv_buffersize", "csv_flush_rows", "csv_flush_time", "csv_flush_bytes",
+                "csv_booltrigger", "csv_timestamp", "csv_align", "csv_aggregate", "csv_rotate_size", "csv_rotate_rows",
+                "csv_rotate_time", "csv_compress", "csv_encoding")
+
+
+def get_gather(indexes):
+    """
+    return function that takes the values of the indexes from the value list in one pass (tuple)
+    """
+    if len(indexes) == 0:
+        return lambda values: ()
+    if len(indexes) == 1:
+        index = indexes[0]
+        return lambda values: (values[index],)
+    return itemgetter(*indexes)
+
+
+class Job(object):
+    def __init__(self, name, settings, background=None):
+        """
+        one csv file of a station: rows, trigger and file like set in the settings
+        settings: project file or an entry of "csv_jobs" (same "csv_..." keys) chained to the project file
+        the settings are compiled to a row plan (indexes and text formats of the columns)
+        """
+        self.name = name
+        self.settings = settings
+        # name of the subscription of the elements of the rows
+        self.consumer = "csv:{name}".format(name=name) if name else "csv"
+        self.csv = csvhandler.CSV()
+        self.csv.background = background
+        # settings, rows and decoder the plan is compiled for
+        self.key = None
+        self.rowdata = None
+        self.decoder = None
+        # row plan
+        self.indexes = []  # elements needed for the rows (subscribed)
+        self.columns = get_gather([])  # takes the values of the columns
+        self.formats = []  # text format of every column
+        self.values = get_gather([])  # takes the values compared with the deadbands (change mode)
+        self.booltrigger = 0  # index of the boolean trigger (0 = none)
+        self.timestamp = 0  # index of the DTL used as timestamp (0 = clock)
+        self.window = None  # aggregation of the frames between two rows (None = values of the trigger frame)
+        self.fresh = False  # frame received since the last saved row
+
+    def settings_check(self, decoder):
+        """
+        set csv handler and compile the row plan if the settings, the rows or the decoder changed
+        return True if compiled (the elements of the rows need to be subscribed again)
+        """
+        settings = self.settings
+        key = tuple(map(settings.get, setting_keys))
+        if key == self.key and settings["csv_rowdata"] is self.rowdata and decoder is self.decoder:
+            return False
+        self.key = key
+        self.rowdata = settings["csv_rowdata"]
+        self.decoder = decoder
+        self.csv.active = settings["csv_active"]
+        self.csv.filename = settings["csv_filename"]
+        self.csv.filepath = settings["csv_filepath"]
+        self.csv.filemode = settings["csv_filemode"]
+        self.csv.triggermode = settings["csv_triggermode"]
+        self.csv.time = settings["csv_time"]
+        self.csv.delimiter = settings["csv_delimiter"]
+        self.csv.align = settings.get("csv_align", True)
+        self.csv.writer.buffersize = int(settings.get("csv_buffersize", 65536))
+        self.csv.writer.flush_rows = int(settings.get("csv_flush_rows", 100))
+        self.csv.writer.flush_time = float(settings.get("csv_flush_time", 1.0))
+        self.csv.writer.flush_bytes = int(settings.get("csv_flush_bytes", 65536))
+        self.csv.writer.rotate_size = int(settings.get("csv_rotate_size", 0))
+        self.csv.writer.rotate_rows = int(settings.get("csv_rotate_rows", 0))
+        self.csv.writer.rotate_time = float(settings.get("csv_rotate_time", 0))
+        self.csv.writer.compression = settings.get("csv_compress", "")
+        self.csv.writer.encoding = self.csv.spill.encoding = settings.get("csv_encoding", "utf-8")
+        self.plan_compile(decoder)
+        # start the time trigger again with the changed settings
+        self.csv.trigger_reset()
+        return True
+
+    def index_check(self, index, size, name):
+        """
+        check the index of an element set in the settings (the datastructure can be changed)
+        a wrong index is reported once when the plan is compiled
+        return True if the index is an element of the datastructure
+        """
+        if isinstance(index, int) and not isinstance(index, bool) and 0 <= index < size:
+            return True
+        if size > 0:
+            self.csv.errors.append("CSV - {file}: {name} not saved, no element {index} in the datastructure".format(
+                file=self.csv.filename, name=name, index=index))
+        return False
+
+    def plan_compile(self, decoder):
+        """
+        compile the row plan: indexes and text formats of the columns and header
+        rows, boolean trigger and timestamp with wrong indexes are left out
+        """
+        settings = self.settings
+        size = len(decoder.datastructure)
+        self.timestamp = settings.get("csv_timestamp", 0)
+        if self.timestamp != 0 and not self.index_check(self.timestamp, size, "timestamp"):
+            self.timestamp = 0
+        self.booltrigger = settings["csv_booltrigger"] if self.csv.triggermode == "boolean" else 0
+        if self.booltrigger != 0 and not self.index_check(self.booltrigger, size, "boolean trigger"):
+            self.booltrigger = 0
+        rowdata = [element for number, element in enumerate(self.rowdata, 1)
+                   if self.index_check(element.get("Variable"), size,
+                                       "row {number} ({text})".format(number=number, text=element.get("Text", "")))]
+        self.csv.deadbands_set([element.get("Deadband", "") for element in rowdata])
+        variables = [element["Variable"] for element in rowdata]
+        texts = [element.get("Text", "") for element in rowdata]
+        selection = settings.get("csv_aggregate", [])
+        columns = []
+        header = []
+        self.window = None
+        if len(decoder.datastructure) > 0:
+            if self.timestamp > 0:
+                columns.append(self.timestamp)
+                header.append("Timestamp")
+            columns.extend(variables)
+            if selection:
+                self.window = aggregate.Window()
+                header.extend(self.window.compile(texts, variables,
+                                                  [decoder.textformats[index] for index in variables],
+                                                  [decoder.datastructure[index]["datatype"] for index in variables],
+                                                  selection))
+            else:
+                header.extend(texts)
+        self.columns = get_gather(columns)
+        self.formats = [decoder.textformats[index] for index in columns]
+        self.values = get_gather(variables if len(decoder.datastructure) > 0 else [])
+        # the header is not changed after this (rows can be queued for the writer thread)
+        self.csv.header = header
+        self.indexes = list(variables)
+        if self.booltrigger > 0:
+            self.indexes.append(self.booltrigger)
+        if self.timestamp > 0:
+            self.indexes.append(self.timestamp)
+
+    def settings_reset(self):
+        """
+        set the settings again with the next frame
+        """
+        self.key = None
+
+    def close(self):
+        """
+        write the buffered csv rows and close the file
+        """
+        self.csv.close()
+
+    def row(self, values):
+        """
+        texts of the columns of the row (a new list for every row, it can be queued for the writer thread)
+        with aggregation the values of the window and the last values of the other columns
+        """
+        if self.window is not None:
+            columns = self.columns(values)
+            if self.timestamp > 0:
+                moment = self.formats[0](columns[0]) if columns[0] is not None else ""
+                return [moment] + self.window.row(columns[1:])
+            return self.window.row(columns)
+        return [text(value) if value is not None else "" for text, value in zip(self.formats, self.columns(values))]
+
+    def process(self, decoder):
+        """
+        add the decoded values to the window (aggregation), check trigger and save csv if triggered
+        the texts of the row are formatted only if the row is saved
+        return the saved row (message, timestamp, header, data, name of the job) or None
+        """
+        values = decoder.values
+        if not self.csv.active:
+            return None
+        self.fresh = True
+        if self.window is not None:
+            self.window.add(values)
+        # native values of the columns to compare them with their deadbands
+        if self.csv.triggermode == "change":
+            self.csv.values = self.values(values)
+        # set csv trigger from boolean variable
+        if self.booltrigger > 0:
+            self.csv.trigger = bool(values[self.booltrigger])
+        return self.save(values)
+
+    def save(self, values):
+        """
+        save csv if triggered
+        return the saved row or None
+        """
+        if not self.csv.triggered():
+            return None
+        self.csv.data = self.row(values)
+        message = self.csv.save()
+        if message is None:
+            return None
+        self.fresh = False
+        moment = values[self.timestamp] if self.timestamp > 0 else None
+        return message, moment, self.csv.header, self.csv.data, self.name
+
+    def deadline(self):
+        """
+        time of the next time trigger (monotonic clock), None if there is none
+        """
+        if self.csv.active and self.csv.interval > 0:
+            return self.csv.deadline
+        return None
+
+    def tick(self, decoder):
+        """
+        save csv if the time trigger is reached between two frames (timer)
+        only if a frame was received since the last saved row, old data is not saved again
+        without a new frame the time trigger is skipped (missed)
+        return the saved row or None
+        """
+        if self.csv.active and self.csv.due():
+            if self.fresh:
+                return self.save(decoder.values)
+            self.csv.skip()
+        return None
+
+
+class Station(object):
+    def __init__(self, name, projectfile):
+        """
+        processing of the data of one PLC without GUI
+        decode the received data with the datastructure of the project and save csv like set in the project
+        every received frame is decoded once for all csv jobs of the project
+        """
+        self.name = name
+        self.projectfile = projectfile
+        # elements every consumer needs from the decoder {consumer: [indexes]}
+        self.subscriptions = {}
+        self.decoder = None
+        self.decoder_load()
+        # writer thread of the csv files (None = write in the processing thread)
+        self.background = None
+        # csv jobs, the first job is set by the "csv_..." keys of the project, the others by "csv_jobs"
+        self.jobs = []
+        self.jobs_load()
+
+    @property
+    def csv(self):
+        """
+        csv handler of the first job (set in the GUI)
+        """
+        return self.jobs[0].csv
+
+    def decoder_load(self):
+        """
+        compile the decoder of the datastructure of the project and subscribe the consumers again
+        """
+        encodings = (self.projectfile.get("opt_string_encoding", readplc.string_encoding),
+                     self.projectfile.get("opt_wstring_encoding", readplc.wstring_encoding))
+        self.decoder = readplc.Decoder(self.projectfile["udt_datastructure"],
+                                       encodings=encodings)
+        for consumer, indexes in self.subscriptions.items():
+            self.decoder.subscribe(consumer, indexes)
+
+    def jobs_load(self):
+        """
+        close the files of the actual jobs and create the jobs of the project
+        keys not set in an entry of "csv_jobs" are taken from the project
+        sample: {"name": "summary", "csv_filename": "hourly", "csv_triggermode": "hours", "csv_time": "1"}
+        """
+        for job in self.jobs:
+            job.close()
+            if job.consumer in self.subscriptions:
+                del self.subscriptions[job.consumer]
+                self.decoder.unsubscribe(job.consumer)
+        self.jobs = [Job("", self.projectfile, self.background)]
+        for number, entry in enumerate(self.projectfile.get("csv_jobs", []), 1):
+            name = entry.get("name", "job{number}".format(number=number))
+            self.jobs.append(Job(name, collections.ChainMap(entry, self.projectfile), self.background))
+        self.csv_setup()
+
+    def project_set(self, projectfile):
+        """
+        change the project (new or opened project file)
+        """
+        self.projectfile = projectfile
+        self.decoder_load()
+        self.jobs_load()
+
+    def background_set(self, background):
+        """
+        write the csv files of all jobs with the writer thread (None = write in the processing thread)
+        """
+        self.background = background
+        for job in self.jobs:
+            job.csv.background = background
+
+    def subscribe(self, consumer, indexes):
+        """
+        save the elements a consumer needs and pass them to the decoder
+        only the subscribed elements get decoded
+        """
+        self.subscriptions[consumer] = indexes
+        self.decoder.subscribe(consumer, indexes)
+
+    def csv_settings(self):
+        """
+        set the csv handlers like set in the project and subscribe the elements of the csv rows
+        only the jobs whose settings changed are compiled again
+        """
+        for job in self.jobs:
+            if job.settings_check(self.decoder):
+                self.subscribe(job.consumer, job.indexes)
+
+    def csv_setup(self):
+        """
+        set the csv handlers like set in the project and start the time triggers again
+        """
+        for job in self.jobs:
+            job.settings_reset()
+        self.csv_settings()
+        for job in self.jobs:
+            job.csv.trigger_reset()
+
+    def deadline(self):
+        """
+        time of the next time trigger of all jobs (monotonic clock), None if there is none
+        """
+        deadlines = [deadline for deadline in (job.deadline() for job in self.jobs) if deadline is not None]
+        if deadlines:
+            return min(deadlines)
+        return None
+
+    def tick(self):
+        """
+        save csv of the jobs whose time trigger is reached between two frames
+        return the saved rows
+        """
+        rows = []
+        for job in self.jobs:
+            row = job.tick(self.decoder)
+            if row is not None:
+                rows.append(row)
+        return rows
+
+    def flush_check(self):
+        """
+        flush the buffered csv rows of all jobs if a limit is reached
+        """
+        for job in self.jobs:
+            job.csv.flush_check()
+
+    def errors_take(self):
+        """
+        return and forget the messages of the errors writing the csv files
+        """
+        errors = []
+        for job in self.jobs:
+            while job.csv.errors:
+                errors.append(job.csv.errors.pop(0))
+        return errors
+
+    def close(self):
+        """
+        write the buffered csv rows and close the files
+        """
+        for job in self.jobs:
+            job.close()
+
+    def datasize(self):
+        """
+        number of bytes of one frame
+        """
+        return int(float(self.projectfile["udt_datasize"]))
+
+    def process(self, recv, channel):
+        """
+        decode received data and save csv of every job if triggered
+        report the processing stages to the channel of the PLC (answer)
+        return set of indexes of the changed elements and the saved rows [(message, timestamp, header, data, job)]
+        """
+        decoded = False
+        rows = []
+        try:
+            # datastructure and settings of the csv can be changed while running (GUI)
+            if self.projectfile["udt_datastructure"] is not self.decoder.datastructure:
+                self.decoder_load()
+            self.csv_settings()
+            changed = self.decoder.update(recv)
+            decoded = True
+            channel.acknowledge("decoded")
+            for job in self.jobs:
+                row = job.process(self.decoder)
+                if row is not None:
+                    rows.append(row)
+        except Exception:
+            # the partner waits for the answer of every frame
+            if not decoded:
+                channel.acknowledge("decoded")
+            channel.acknowledge("saved", saved=len(rows) > 0)
+            raise
+        channel.acknowledge("saved", saved=len(rows) > 0)
+        return changed, rows
+
+
+def station_load(name, path):
+    """
+    open project file of a station
+    """
+    with open(path) as projectfile:
+        return Station(name=name, projectfile=json.load(projectfile))
+
+
+def address_get(projectfile):
+    """
+    ip-address and port of the server set in the project
+    """
+    ip = "{byte1}.{byte2}.{byte3}.{byte4}".format(byte1=str(int(projectfile["con_ip_byte1"])),
+                                                  byte2=str(int(projectfile["con_ip_byte2"])),
+                                                  byte3=str(int(projectfile["con_ip_byte3"])),
+                                                  byte4=str(int(projectfile["con_ip_byte4"])))
+    return ip, int(projectfile["con_port"])
+
+
+def writer_load(projectfile, writer=None):
+    """
+    writer thread of the csv files like set in the project (None if the queue size is 0)
+    writer: actual writer thread, it is kept and set like the project (another project opened)
+    """
+    size = int(projectfile.get("csv_queue_size", 1000))
+    if size < 1:
+        return None
+    if writer is not None:
+        writer.configure(size=size,
+                         overflow=projectfile.get("csv_overflow", "block"),
+                         spillpath=projectfile.get("csv_spillpath", "spill"))
+        return writer
+    return csvhandler.WriterThread(size=size,
+                                   overflow=projectfile.get("csv_overflow", "block"),
+                                   spillpath=projectfile.get("csv_spillpath", "spill"))
+
+
+def stations_load(routes, port):
+    """
+    open the projects of the routed PLCs (projectfile key "con_routes")
+    every PLC is routed by its own port and/or its ip-address to its own channel
+    sample: {"name": "Line1 PLC2", "port": "1025", "partner": "192.168.0.12", "project": "plc2.cplc"}
+    return the channels and their stations [(channel, station)] and the messages of the routes not loaded
+    """
+    stations = []
+    errormessages = []
+    for route in routes:
+        try:
+            routed = station_load(name=route["name"], path=route["project"])
+        except (OSError, ValueError, KeyError) as errormessage:
+            errormessages.append("Route {route} not loaded: {errormessage}".format(
+                route=route.get("name", ""), errormessage=errormessage))
+            continue
+        channel = tcpserver.Channel(name=route["name"],
+                                    port=int(route.get("port", port)),
+                                    datasize=routed.datasize(),
+                                    partner=route.get("partner", ""),
+                                    ackmode=routed.projectfile.get("con_ackmode", "saved"))
+        stations.append((channel, routed))
+    return stations, errormessages
@@ -16,10 +16,244 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import socket
+import asyncio
 import queue
 import threading
-import time
+import collections
+
+# free bytes in the ring buffer of a connection for receiving
+ring_reserve = 65536
+
+# stage of the processing that is answered to the partner
+# "saved": after decoding and saving csv (partner waits for the whole processing)
+# "decoded": after decoding, saved csv is reported with the next answer
+# "received": immediately by the server, saved csv is reported with the next answer
+# "none": no answer (partner streams without waiting)
+ackmodes = ["saved", "decoded", "received", "none"]
+
+
+class AnswerBuffer(object):
+    def __init__(self, loop):
+        """
+        buffer for the answers to a partner
+        put can be called from every thread (like queue.Queue), get is awaited in the event loop of the server
+        """
+        self.loop = loop
+        self.answers = None
+
+    def put(self, data):
+        """
+        put answer to buffer (thread safe)
+        """
+        self.loop.call_soon_threadsafe(self.answers_put, data)
+
+    def answers_put(self, data):
+        if self.answers is None:
+            self.answers = asyncio.Queue()
+        self.answers.put_nowait(data)
+
+    async def get(self):
+        """
+        wait for the next answer
+        """
+        if self.answers is None:
+            self.answers = asyncio.Queue()
+        return await self.answers.get()
+
+    def clear(self):
+        """
+        delete answers that are left from the last connection (call in event loop)
+        """
+        self.answers = asyncio.Queue()
+
+
+class Connection(asyncio.BufferedProtocol):
+    def __init__(self, server, port):
+        """
+        connection of one partner
+        received bytes are written by the event loop directly into a preallocated ring buffer (recv_into)
+        every complete frame is copied once into an immutable bytestring, no lists or slices of the buffer
+        """
+        self.server = server
+        self.port = port
+        self.channel = None
+        self.transport = None
+        self.answers = None  # task sending the answers to the partner
+        self.pending = 0  # number of frames waiting for an answer
+        self.ring = bytearray(0)
+        self.view = memoryview(self.ring)
+        self.start = 0  # position of the first byte of the next frame
+        self.end = 0  # position of the end of the received bytes
+
+    def connection_made(self, transport):
+        """
+        route new connection to its channel
+        """
+        self.transport = transport
+        partner = transport.get_extra_info("peername")
+        channel = self.server.channel_get(self.port, partner[0])
+        if channel is None or channel.connected or not self.server.active:
+            self.server.message("", "Server refused connection from {partner}".format(partner=partner))
+            transport.close()
+            return
+        self.channel = channel
+        channel.connected = True
+        channel.partner_ip = partner
+        channel.buffer_send.clear()
+        # ring buffer holds 2 frames and a leftover, it is allocated once per connection
+        self.ring = bytearray(2 * channel.datasize + ring_reserve)
+        self.view = memoryview(self.ring)
+        self.server.connections.add(self)
+        self.answers = asyncio.ensure_future(self.answer())
+        name = self.server.channel_name(channel)
+        self.server.message("", "Server{name} connected to {partner}".format(name=name, partner=partner))
+        self.server.message("", "Server{name} waiting for data".format(name=name))
+
+    def get_buffer(self, sizehint):
+        """
+        return the free part of the ring buffer for receiving
+        the leftover bytes (less than one frame) are moved to the beginning if the free part gets too small
+        """
+        if len(self.ring) - self.end < ring_reserve:
+            leftover = self.end - self.start
+            self.ring[:leftover] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = leftover
+        return self.view[self.end:]
+
+    def buffer_updated(self, nbytes):
+        """
+        bytes received: put every complete frame in the receive buffer of the channel
+        """
+        self.end += nbytes
+        datasize = self.channel.datasize
+        if datasize <= 0:
+            # without datasize every package is one empty frame
+            self.start = self.end = 0
+            self.frame(b"")
+            return
+        while self.end - self.start >= datasize:
+            self.frame(bytes(self.view[self.start:self.start + datasize]))
+            self.start += datasize
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    def frame(self, recv):
+        """
+        put received frame in buffer, answer it or stop receiving until the answer is sent
+        """
+        if self.server.encode_decode:  # if activated the data will be decoded
+            recv = recv.decode(self.server.format, 'ignore')  # format received data
+        self.channel.frames += 1
+        # the connection is taken with the frame, answers of frames of an earlier connection are not sent
+        self.channel.origins.append(self)
+        self.channel.buffer_recv.put(recv)  # put received data in buffer
+        if self.channel.wakeup is not None:
+            self.channel.wakeup.set()
+        if self.channel.ackmode == "received":
+            self.transport.write(self.channel.answer())
+        elif self.channel.ackmode != "none":
+            # stop receiving until the answer is sent
+            self.pending += 1
+            if self.pending == 1:
+                self.transport.pause_reading()
+
+    async def answer(self):
+        """
+        send the answers to the partner
+        """
+        while True:
+            origin, send = await self.channel.buffer_send.get()  # waiting for data in buffer
+            if origin is not self:
+                # answer of a frame of an earlier connection
+                continue
+            if self.server.encode_decode:  # if activated the data will be encoded
+                send = send.encode(self.server.format, 'ignore')  # format send data
+            self.transport.write(send)
+            self.pending -= 1
+            if self.pending == 0 and not self.transport.is_closing():
+                self.transport.resume_reading()
+
+    def eof_received(self):
+        """
+        partner closed connection
+        """
+        if self.channel is not None:
+            self.server.message("", "Server{name} lost connection to {partner}".format(
+                name=self.server.channel_name(self.channel), partner=self.channel.partner_ip))
+        return False
+
+    def connection_lost(self, errormessage):
+        """
+        connection closed, channel is free for the next connection
+        """
+        if self.channel is None:
+            return
+        if errormessage is not None:
+            self.server.message("", "Server{name} {errormessage}".format(
+                name=self.server.channel_name(self.channel), errormessage=errormessage))
+        if self.answers is not None:
+            self.answers.cancel()
+        self.channel.connected = False
+        self.server.connections.discard(self)
+
+    def close(self):
+        """
+        close connection
+        """
+        self.transport.close()
+
+
+class Channel(object):
+    def __init__(self, name="", port=0, datasize=0, partner="", ackmode="saved"):
+        """
+        route for the connections of one partner
+        connections are routed by the local port and the ip-address of the partner ("" = every partner)
+        every channel has its own buffers and state
+        """
+        self.name = name  # name of the channel for the messages ("" = main channel)
+        self.port = port  # local port
+        self.partner = partner  # ip-address of the partner, "" = every partner
+        self.datasize = datasize  # number of bytes of one frame
+        self.ackmode = ackmode if ackmode in ackmodes else "saved"  # stage of the processing that is answered
+        self.saved = False  # csv saved since the last answer
+        self.connected = False  # flag to indicate if connection is established
+        self.partner_ip = ""  # ip-address of connected partner
+        self.buffer_recv = queue.Queue()  # buffer for received data
+        self.buffer_send = None  # buffer for data to send (created by server)
+        self.origins = collections.deque()  # connection of every frame in the receive buffer
+        self.origin = None  # connection of the frame in processing (its answers are sent only to it)
+        self.frames = 0  # number of received frames since start
+        self.wakeup = None  # event set for every received frame (processing thread)
+
+    def frame_get(self):
+        """
+        take the next received frame from the buffer (processing thread)
+        raise queue.Empty if no frame is received
+        """
+        recv = self.buffer_recv.get(block=False)
+        self.origin = self.origins.popleft()
+        return recv
+
+    def answer(self):
+        """
+        answer to the partner, "Saved" if csv was saved since the last answer
+        """
+        saved = self.saved
+        self.saved = False
+        if saved:
+            return str.encode("Saved     ")
+        return str.encode("Recieved  ")
+
+    def acknowledge(self, stage, saved=False):
+        """
+        report processing stage of a frame ("decoded" or "saved")
+        the answer is sent if the stage is the ackmode of the channel
+        """
+        if saved:
+            self.saved = True
+        if stage == self.ackmode:
+            self.buffer_send.put((self.origin, self.answer()))
 
 
 class Server(object):
@@ -27,127 +261,73 @@ class Server(object):
         """
         setup connection parameters
         setup buffers
-        setup thread
+        setup event loop in thread
         """
         # connection parameters
         self.ip = "127.0.0.1"  # local ip-address
         self.port = 0  # local port
         self.encode_decode = False  # recv/send bytes should be en/decoded?
         self.format = "utf-8"  # format to en/decode recv/send bytes
-        self.connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.active = False  # server start and stop flag
-        self.timeout = False  # flag to restart waiting for connections
-        self.connected = False  # flat to indicate if connection is established
-        self.partner_ip = ""  # ip-address of connected partner
-        self.partner_id = None  # connection id to receive and end data
         self.datasize = 0  # number of bytes to collect while receiving
-        self.buffer_package = []  # bytes from the received packages
-        # buffers
+        # event loop of the server (all connections are handled in one thread)
+        self.loop = asyncio.new_event_loop()
+        self.listeners = []  # listening servers, one for every port
+        self.starting = None  # task opening the listening servers
+        self.connections = set()  # connected partners
+        # buffers of the main channel
         self.buffer_recv = queue.Queue()  # buffer for received data
-        self.buffer_send = queue.Queue()  # buffer for data to send
+        self.buffer_send = AnswerBuffer(self.loop)  # buffer for data to send
         self.buffer_message = queue.Queue()  # buffer for messages
+        # channels {routed by port and partner ip-address}, the main channel uses the buffers above
+        self.channel = Channel()
+        self.channel.buffer_recv = self.buffer_recv
+        self.channel.buffer_send = self.buffer_send
+        self.channels = [self.channel]
         # threading parameters
         self.thread = threading.Thread(target=self.run, args=())  # function to be running in thread
         self.thread.daemon = True  # setup thread to end after main programm ends
         self.thread.start()  # start thread
 
+    @property
+    def connected(self):
+        """
+        True if at least one partner is connected
+        """
+        return any(channel.connected for channel in self.channels)
+
     def run(self):
         """
-        connect to partner
-        receive data
-        send data
-        """
-        while True:  # infinite loop
-            time.sleep(0.001)
-            while self.active and not self.connected:  # start connecting
-                try:  # try to open socket and connect to requesting partner
-                    if not self.timeout:  # messages are muted when timeout occurred
-                        self.message("", "Server starting".format(ip=self.ip, port=self.port))
-                    self.connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                    self.connection.bind((self.ip, self.port))  # create connection channel
-                    if not self.timeout:  # messages are muted when timeout occurred
-                        self.message("", "Server active @ IP ({ip}) Port ({port})".format(ip=self.ip, port=self.port))
-                        self.message("", "Server listening for connection".format(ip=self.ip, port=self.port))
-                    self.connection.listen(0)  # wait for partner to connect
-                    self.connection.settimeout(1)  # turn on listeningtime to check if server is turned off manually
-                    self.partner_id, self.partner_ip = self.connection.accept()  # save partner id and address
-                    self.message("", "Server connected to {partner}".format(partner=self.partner_ip))
-                except Exception as errormessage:  # an error occurred
-                    if "timed out" in str(errormessage):  # if error = timeout --> retry connecting with muted messages
-                        self.timeout = True
-                    else:
-                        self.timeout = False
-                        self.message("stop", "Servererror {errormessage}".format(errormessage=errormessage))
-                        self.connection.close()
-                        self.connected = False
-                        self.active = False
-                        break
-                else:  # connection established start datatransfer
-                    self.timeout = False
-                    self.message("", "Server waiting for data")
-                    self.connected = True
-
-            while self.active and self.connected:  # start datatransfer
-
-                try:  # try to receive data
-                    self.partner_id.settimeout(1)  # turn on listeningtime to check if server is turned off manually
-                    recv = self.partner_id.recv(1000)  # waiting for maximal 1000 bytes data
-                except Exception as errormessage:  # an error occurred
-                    if "timed out" in str(errormessage):  # if error = timeout --> retry receiving data
-                        self.timeout = True
-                    else:  # break datatransfer, close connection and restart
-                        self.timeout = False
-                        self.message("", str(errormessage))
-                        self.connection.close()
-                        self.connected = False
-                        break
-                else:  # data received
-                    self.timeout = False
-                    if self.encode_decode:  # if activated the data will be decoded
-                        recv = recv.decode(self.format, 'ignore')  # format received data
-                    if not recv:  # if no data in received data, partner closed connection
-                        self.message("", "Server lost connection to {partner}".format(partner=self.partner_ip))
-                        self.connection.close()
-                        self.connected = False
-                        break
-                    else:
-                        self.buffer_package += recv  # save received data in package buffer
-                        # print("Server received {x}/{y} bytes".format(x=len(self.buffer_package), y=self.datasize))
-                        # check if all bytes (defined by self.datasize) are collected
-                        if len(self.buffer_package) >= self.datasize:
-                            # if more bytes in package buffer than expected put the expected bytes in receive buffer
-                            # save the leftover bytes for the next receiving
-                            newdata = self.buffer_package[:self.datasize]  # = expected size of bytes
-                            nextdata = self.buffer_package[self.datasize:]  # > expected size of bytes
-                            self.buffer_recv.put(newdata)  # put received data in buffer
-                            self.buffer_package = nextdata  # save the leftover bytes
-                            # send answer to partner
-                            send = self.buffer_send.get(block=True)  # waiting for data in buffer
-                            if self.encode_decode:  # if activated the data will be encoded
-                                send = send.encode(self.format, 'ignore')  # format send data
-                            try:  # try to send data
-                                self.partner_id.send(send)
-                            except Exception as errormessage:  # an error occurred
-                                # break datatransfer, close connection and restart
-                                self.message("", str(errormessage))
-                                self.connection.close()
-                                self.connected = False
-                                break
-                        # not all bytes received keep on receiving
-                        else:
-                            self.timeout = False
-
-    def start(self, ip, port, datasize):
+        run event loop of the server
+        """
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def start(self, ip, port, datasize, routes=(), ackmode="saved"):
         """
         start communication
+        routes: additional channels (own port and/or own partner ip-address)
+        ackmode: stage of the processing that is answered to the partner of the main channel
         """
         self.ip = ip
         self.port = port
         self.datasize = datasize
+        self.channel.port = port
+        self.channel.datasize = datasize
+        self.channel.ackmode = ackmode if ackmode in ackmodes else "saved"
+        self.channel.saved = False
+        for channel in routes:
+            channel.buffer_send = AnswerBuffer(self.loop)
+        self.channels = [self.channel] + list(routes)
         # set server to active
         self.active = True
-        self.timeout = False
+        self.loop.call_soon_threadsafe(self.listen_start)
+
+    def listen_start(self):
+        """
+        start opening the listening servers (call in event loop)
+        """
+        self.starting = self.loop.create_task(self.listen())
 
     def stop(self):
         """
@@ -155,9 +335,72 @@ class Server(object):
         """
         # set server to inactive
         self.active = False
-        self.timeout = False
+        self.loop.call_soon_threadsafe(self.stopped)
+
+    def stopped(self):
+        """
+        close the server after the servers opened so far (call in event loop)
+        """
+        self.close()
         self.message("", "Server stopped")
 
+    def close(self):
+        """
+        close all listening servers and connections (call in event loop)
+        a server still opening its listening servers is cancelled
+        """
+        if self.starting is not None:
+            self.starting.cancel()
+            self.starting = None
+        for listener in self.listeners:
+            listener.close()
+        self.listeners = []
+        for connection in list(self.connections):
+            connection.close()
+
+    async def listen(self):
+        """
+        open one listening server for every port of the channels
+        """
+        self.message("", "Server starting")
+        ports = sorted(set(channel.port for channel in self.channels))
+        try:
+            for port in ports:
+                listener = await self.loop.create_server(lambda port=port: Connection(self, port),
+                                                         self.ip, port, reuse_address=True)
+                self.listeners.append(listener)
+                self.message("", "Server active @ IP ({ip}) Port ({port})".format(ip=self.ip, port=port))
+        except Exception as errormessage:  # an error occurred
+            self.message("stop", "Servererror {errormessage}".format(errormessage=errormessage))
+            self.active = False
+            self.starting = None
+            self.close()
+            return
+        self.starting = None
+        self.message("", "Server listening for connection")
+
+    def channel_get(self, port, partner_ip):
+        """
+        get channel of a new connection
+        channels with the ip-address of the partner are preferred to channels for every partner
+        """
+        for channel in self.channels:
+            if channel.port == port and channel.partner == partner_ip:
+                return channel
+        for channel in self.channels:
+            if channel.port == port and channel.partner == "":
+                return channel
+        return None
+
+    @staticmethod
+    def channel_name(channel):
+        """
+        name of channel for messages (sample: " [Line1 PLC2]", main channel = "")
+        """
+        if channel.name:
+            return " [{name}]".format(name=channel.name)
+        return ""
+
     def message(self, cmd, message):
         """
         put message to buffer
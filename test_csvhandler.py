@@ -0,0 +1,218 @@
+"""
+ConPlc - connect PLC and PC
+Copyright (C) 2021  Marvin Mangold (Marvin.Mangold00@googlemail.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import csv
+import time
+import threading
+import pytest
+import csvhandler
+
+
+def read_rows(filepath, function=open):
+    """
+    read the rows of a csv file (compressed with function)
+    """
+    with function(filepath, mode="rt", newline="") as file:
+        return list(csv.reader(file, delimiter=";"))
+
+
+def get_handler(background=None):
+    """
+    create csv handler with one column
+    """
+    handler = csvhandler.CSV()
+    handler.header = ["value"]
+    handler.background = background
+    return handler
+
+
+def queue_row(background, handler, filepath, value):
+    """
+    queue a row of the csv handler to the writer thread
+    """
+    handler.data = [value]
+    background.row(handler, filepath)
+
+
+def block(background):
+    """
+    keep the writer thread busy with a job until the returned event is set
+    """
+    release = threading.Event()
+    background.put(("call", None, release.wait, (), time.monotonic()))
+    while background.metrics()["depth"]:
+        time.sleep(0.01)
+    return release
+
+
+def test_rotate_rows(tmp_path):
+    filepath = str(tmp_path / "newfile.csv")
+    writer = csvhandler.Writer()
+    writer.rotate_rows = 2
+    for value in range(5):
+        writer.row(filepath, ";", ["value"], [value])
+    writer.close()
+    segments = sorted(name for name in os.listdir(str(tmp_path)) if name != "newfile.csv")
+    assert writer.rotations == 2 and len(segments) == 2
+    # more than one rotation in a second gets a number
+    assert segments[1].startswith(segments[0][:-4])
+    rows = [row for name in segments for row in read_rows(str(tmp_path / name))]
+    assert rows == [["value"], ["0"], ["1"], ["value"], ["2"], ["3"]]
+    assert read_rows(filepath) == [["value"], ["4"]]
+    assert writer.errors == []
+
+
+def test_rotate_size(tmp_path):
+    filepath = str(tmp_path / "newfile.csv")
+    writer = csvhandler.Writer()
+    writer.rotate_size = 20
+    for value in range(10):
+        writer.row(filepath, ";", ["value"], [value])
+    writer.close()
+    # header "value\r\n" and 5 rows of 3 bytes reach the size
+    assert writer.rotations == 2 and not os.path.exists(filepath)
+    for name in os.listdir(str(tmp_path)):
+        assert os.path.getsize(str(tmp_path / name)) == 22
+        assert len(read_rows(str(tmp_path / name))) == 6
+
+
+@pytest.mark.parametrize("compression", sorted(csvhandler.compressions))
+def test_rotate_compress(tmp_path, compression):
+    filepath = str(tmp_path / "newfile.csv")
+    writer = csvhandler.Writer()
+    writer.rotate_rows = 1
+    writer.compression = compression
+    for value in range(3):
+        writer.row(filepath, ";", ["value"], [value])
+    with writer.lock:
+        compressor = writer.compressor
+    if compressor is not None:
+        compressor.join()
+    function, extension = csvhandler.compressions[compression]
+    names = sorted(os.listdir(str(tmp_path)))
+    assert len(names) == 3 and all(name.endswith(".csv" + extension) for name in names)
+    assert [read_rows(str(tmp_path / name), function) for name in names] == [[["value"], [str(value)]]
+                                                                              for value in range(3)]
+    assert writer.errors == []
+
+
+def test_changed():
+    handler = get_handler()
+    handler.deadbands_set(["0.5", "10%", ""])
+    handler.lastvalues = (1.0, 100.0, "a")
+    for values, changed in [((1.4, 100.0, "a"), False), ((1.6, 100.0, "a"), True), ((1.0, 109.0, "a"), False),
+                            ((1.0, 111.0, "a"), True), ((1.0, 100.0, "b"), True)]:
+        handler.values = values
+        assert handler.changed() == changed
+    nan = float("nan")
+    handler.lastvalues = (nan, 100.0, "a")
+    handler.values = (float("nan"), 100.0, "a")
+    assert not handler.changed()
+    handler.values = (1.0, 100.0, "a")
+    assert handler.changed()
+
+
+def test_writer_thread(tmp_path):
+    filepath = str(tmp_path / "newfile.csv")
+    background = csvhandler.WriterThread(size=10)
+    handler = get_handler(background)
+    for value in range(3):
+        queue_row(background, handler, filepath, value)
+    background.close(handler)
+    assert background.wait(5)
+    assert read_rows(filepath) == [["value"], ["0"], ["1"], ["2"]]
+    assert background.metrics()["written"] == 3
+    background.stop()
+
+
+def test_writer_thread_error(tmp_path):
+    background = csvhandler.WriterThread(size=10)
+    handler = get_handler(background)
+    # a row that can not be written loses only its row
+    queue_row(background, handler, str(tmp_path / "missing" / "newfile.csv"), 0)
+    queue_row(background, handler, str(tmp_path / "newfile.csv"), 1)
+    background.close(handler)
+    assert background.wait(5)
+    assert background.thread.is_alive()
+    assert background.metrics()["dropped"] == 1 and len(handler.errors) == 1
+    assert read_rows(str(tmp_path / "newfile.csv")) == [["value"], ["1"]]
+    background.stop()
+
+
+def test_overflow_block(tmp_path):
+    filepath = str(tmp_path / "newfile.csv")
+    background = csvhandler.WriterThread(size=1, overflow="block")
+    handler = get_handler(background)
+    release = block(background)
+    queue_row(background, handler, filepath, 0)
+    waiting = threading.Thread(target=queue_row, args=(background, handler, filepath, 1))
+    waiting.start()
+    waiting.join(0.3)
+    assert waiting.is_alive()
+    release.set()
+    waiting.join(5)
+    background.close(handler)
+    assert background.wait(5)
+    assert read_rows(filepath) == [["value"], ["0"], ["1"]]
+    assert background.metrics()["dropped"] == 0
+    background.stop()
+
+
+def test_overflow_drop_oldest(tmp_path):
+    filepath = str(tmp_path / "newfile.csv")
+    background = csvhandler.WriterThread(size=1, overflow="drop-oldest")
+    handler = get_handler(background)
+    release = block(background)
+    queue_row(background, handler, filepath, 0)
+    queue_row(background, handler, filepath, 1)
+    assert background.metrics()["dropped"] == 1
+    release.set()
+    background.close(handler)
+    assert background.wait(5)
+    assert read_rows(filepath) == [["value"], ["1"]]
+    background.stop()
+
+
+def test_overflow_spill(tmp_path):
+    filepath = str(tmp_path / "newfile.csv")
+    spillpath = str(tmp_path / "spill")
+    background = csvhandler.WriterThread(size=1, overflow="spill", spillpath=spillpath)
+    handler = get_handler(background)
+    release = block(background)
+    queue_row(background, handler, filepath, 0)
+    queue_row(background, handler, filepath, 1)
+    release.set()
+    handler.close()
+    assert background.wait(5)
+    assert background.metrics()["spilled"] == 1
+    assert read_rows(filepath) == [["value"], ["0"]]
+    assert read_rows(os.path.join(spillpath, "newfile.csv")) == [["value"], ["1"]]
+    background.stop()
+
+
+def test_writer_thread_stopped(tmp_path):
+    filepath = str(tmp_path / "newfile.csv")
+    background = csvhandler.WriterThread(size=1)
+    handler = get_handler(background)
+    background.stop()
+    background.thread.join(5)
+    # rows queued after the stop are written in the calling thread
+    queue_row(background, handler, filepath, 0)
+    background.close(handler)
+    assert read_rows(filepath) == [["value"], ["0"]]
@@ -0,0 +1,176 @@
+"""
+ConPlc - connect PLC and PC
+Copyright (C) 2021  Marvin Mangold (Marvin.Mangold00@googlemail.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import struct
+import datetime
+import pytest
+import readplc
+from benchmark import get_entry, get_structure_axes, get_structure_bools
+
+
+def get_structure_dtl():
+    """
+    create datastructure with Word and DTL like readudt does
+    return datastructure and datasize
+    """
+    datastructure = [get_entry("", "START_STRUCT", 0, 0), get_entry("counter", "Word", 0, 2)]
+    declaration = get_entry("moment", "DTL", 2, 12)
+    declaration["action"] = "open"
+    declaration["access"] = False
+    datastructure.append(declaration)
+    fields = [("YEAR", "UInt", 2, 2), ("MONTH", "USInt", 4, 1), ("DAY", "USInt", 5, 1), ("WEEKDAY", "USInt", 6, 1),
+              ("HOUR", "USInt", 7, 1), ("MINUTE", "USInt", 8, 1), ("SECOND", "USInt", 9, 1),
+              ("NANOSECOND", "UDInt", 10, 4)]
+    for name, datatype, byte, size in fields:
+        datastructure.append(get_entry("moment.{name}".format(name=name), datatype, byte, size))
+    closing = get_entry("moment", "DTL", 2, 0)
+    closing["action"] = "close"
+    closing["access"] = False
+    datastructure.append(closing)
+    datastructure.append(get_entry("", "END_STRUCT", 14, 0))
+    return datastructure, 14
+
+
+def get_frame_axes(count, values):
+    """
+    create frame of axes, values: function returning the values (bools, mode, speed, position, torque) of an axis
+    """
+    return struct.pack(">" + "BBhff" * count, *[value for axis in range(count) for value in values(axis)])
+
+
+def get_index(datastructure, name):
+    """
+    index of the element with the name
+    """
+    return [element["name"] for element in datastructure].index(name)
+
+
+def test_decode_axes():
+    datastructure, datasize = get_structure_axes(count=4)
+    decoder = readplc.Decoder(datastructure)
+    values = decoder.decode(get_frame_axes(4, lambda axis: (0b101, axis, -axis, axis + 0.5, 0.25)))
+    assert values[get_index(datastructure, "axes.[2].Enabled")] is True
+    assert values[get_index(datastructure, "axes.[2].Fault")] is False
+    assert values[get_index(datastructure, "axes.[2].Ready")] is True
+    assert values[get_index(datastructure, "axes.[3].Speed")] == -3
+    assert values[get_index(datastructure, "axes.[1].Position")] == 1.5
+    assert decoder.text(get_index(datastructure, "axes.[3].Mode")) == "16#3"
+    assert decoder.column(get_index(datastructure, "axes.[0].Speed")) == [0, -1, -2, -3]
+
+
+def test_update_decodes_changed_fields():
+    datastructure, datasize = get_structure_axes(count=100)
+    decoder = readplc.Decoder(datastructure)
+    frame = get_frame_axes(100, lambda axis: (0, 1, axis, 0.5, 0.25))
+    assert decoder.update(frame) == set(decoder.selection)
+    assert decoder.update(frame) == set()
+    changed = get_frame_axes(100, lambda axis: (1 if axis == 7 else 0, 1, axis, 2.5 if axis == 90 else 0.5, 0.25))
+    assert decoder.update(changed) == {get_index(datastructure, "axes.[7].Enabled"),
+                                       get_index(datastructure, "axes.[90].Position")}
+    assert decoder.values == readplc.Decoder(datastructure).decode(changed)
+
+
+def test_update_bitfield():
+    datastructure, datasize = get_structure_bools(count=64)
+    decoder = readplc.Decoder(datastructure)
+    decoder.update(bytes(datasize))
+    frame = bytearray(datasize)
+    frame[5] = 0b1000
+    assert decoder.update(bytes(frame)) == {5 * 8 + 3}
+    assert decoder.values[5 * 8 + 3] is True
+    assert decoder.bits(0).indexes() == [5 * 8 + 3]
+
+
+def test_update_nan_unchanged():
+    datastructure = [get_entry("real", "Real", 0, 4), get_entry("lreal", "LReal", 4, 8)]
+    decoder = readplc.Decoder(datastructure)
+    nan = b"\x7f\xf8" + bytes(6)
+    decoder.update(b"\x7f\xc0\x00\x00" + nan)
+    # another NaN is no change, a number is
+    assert decoder.update(b"\x7f\xc0\x00\x01" + nan) == set()
+    assert decoder.update(struct.pack(">f", 1.5) + nan) == {0}
+    assert decoder.update(b"\x7f\xc0\x00\x00" + struct.pack(">d", 2.5)) == {0, 1}
+
+
+def test_subscribe():
+    datastructure = [get_entry("counter", "Int", 0, 2), get_entry("speed", "Int", 2, 2),
+                     get_entry("position", "Real", 4, 4), get_entry("torque", "Real", 8, 4)]
+    frame = struct.pack(">hhff", 1, 2, 3.5, 4.5)
+    decoder = readplc.Decoder(datastructure)
+    decoder.subscribe("csv", [1])
+    decoder.subscribe("datatree", [2])
+    assert decoder.decode(frame) == [None, 2, 3.5, None]
+    # the frame after a changed subscription is decoded completely
+    decoder.update(frame)
+    decoder.unsubscribe("datatree")
+    assert decoder.update(frame) == {1}
+    decoder.unsubscribe("csv")
+    assert decoder.decode(frame) == [1, 2, 3.5, 4.5]
+
+
+def test_subscribe_structarray():
+    datastructure, datasize = get_structure_axes(count=10)
+    frame = get_frame_axes(10, lambda axis: (1, axis, axis, 0.5, 0.25))
+    decoder = readplc.Decoder(datastructure)
+    # the items of an array of UDT are decoded together
+    decoder.subscribe("csv", [get_index(datastructure, "axes.[4].Speed")])
+    values = decoder.decode(frame)
+    assert values[get_index(datastructure, "axes.[5].Speed")] == 5
+    assert decoder.size == datasize
+
+
+def test_decode_dtl():
+    datastructure, datasize = get_structure_dtl()
+    decoder = readplc.Decoder(datastructure)
+    values = decoder.decode(struct.pack(">HHBBBBBBI", 7, 2021, 5, 14, 6, 12, 30, 45, 123456789))
+    assert values[2] == datetime.datetime(2021, 5, 14, 12, 30, 45, 123456)
+    assert decoder.text(2) == "DTL#2021-05-14-12:30:45.123456"
+    assert decoder.timestamp(2) == 1620995445123456789
+    # not initialised in the PLC
+    assert decoder.decode(bytes(datasize))[2] is None
+
+
+def test_decode_batch():
+    numpy = pytest.importorskip("numpy")
+    datastructure, datasize = get_structure_axes(count=20)
+    frames = [get_frame_axes(20, lambda axis: (axis + frame, frame, axis * frame, axis / 4, frame / 8))
+              for frame in range(50)]
+    decoder = readplc.Decoder(datastructure)
+    columns = decoder.decode_batch(frames)
+    for number, frame in enumerate(frames):
+        values = readplc.Decoder(datastructure).decode(frame)
+        for index, column in columns.items():
+            assert column[number] == values[index]
+    joined = decoder.decode_batch(b"".join(frames), framesize=datasize)
+    assert all(numpy.array_equal(joined[index], columns[index]) for index in columns)
+    with pytest.raises(ValueError):
+        decoder.decode_batch(b"".join(frames))
+    with pytest.raises(ValueError):
+        decoder.decode_batch(b"".join(frames)[1:], framesize=datasize)
+
+
+def test_decode_batch_dtl():
+    pytest.importorskip("numpy")
+    datastructure, datasize = get_structure_dtl()
+    frames = [struct.pack(">HHBBBBBBI", 1, 2020, 2, 29, 7, 23, 59, 59, 999999999),
+              struct.pack(">HHBBBBBBI", 2, 2021, 2, 29, 1, 0, 0, 0, 0),
+              bytes(datasize)]
+    columns = readplc.Decoder(datastructure).decode_batch(frames)
+    assert list(columns[2]) == [datetime.datetime(2020, 2, 29, 23, 59, 59, 999999), None, None]
+    assert list(columns[1]) == [1, 2, 0]
+    assert list(columns[10]) == [999999999, 0, 0]
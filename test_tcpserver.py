@@ -0,0 +1,160 @@
+"""
+ConPlc - connect PLC and PC
+Copyright (C) 2021  Marvin Mangold (Marvin.Mangold00@googlemail.com)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import time
+import queue
+import socket
+import pytest
+import tcpserver
+
+
+class Answers(object):
+    def __init__(self):
+        """
+        answer buffer of a channel without event loop
+        """
+        self.answers = []
+
+    def put(self, data):
+        self.answers.append(data[1])
+
+
+def get_port():
+    """
+    free local port
+    """
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        return listener.getsockname()[1]
+
+
+def wait_message(server, text, timeout=5):
+    """
+    wait for a message of the server
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            cmd, message = server.buffer_message.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if message.startswith(text):
+            return message
+    raise AssertionError("no message {text}".format(text=text))
+
+
+def receive(partner, size):
+    """
+    receive size bytes from the server
+    """
+    data = b""
+    while len(data) < size:
+        data += partner.recv(size - len(data))
+    return data
+
+
+def get_channel(ackmode):
+    channel = tcpserver.Channel(ackmode=ackmode)
+    channel.buffer_send = Answers()
+    return channel
+
+
+@pytest.mark.parametrize("ackmode, answers", [("saved", [b"Saved     ", b"Recieved  "]),
+                                              ("decoded", [b"Recieved  ", b"Saved     "]),
+                                              ("none", [])])
+def test_acknowledge(ackmode, answers):
+    channel = get_channel(ackmode)
+    # frame saved to csv, then frame not saved
+    channel.acknowledge("decoded")
+    channel.acknowledge("saved", saved=True)
+    channel.acknowledge("decoded")
+    channel.acknowledge("saved")
+    assert channel.buffer_send.answers == answers
+
+
+def test_ackmode_unknown():
+    assert tcpserver.Channel(ackmode="later").ackmode == "saved"
+
+
+@pytest.fixture
+def server():
+    server = tcpserver.Server()
+    yield server
+    server.stop()
+    wait_message(server, "Server stopped")
+
+
+def connect(server, ackmode, datasize=4):
+    """
+    start server and connect a partner
+    """
+    port = get_port()
+    server.start("127.0.0.1", port, datasize, ackmode=ackmode)
+    wait_message(server, "Server listening")
+    partner = socket.create_connection(("127.0.0.1", port), timeout=5)
+    wait_message(server, "Server waiting")
+    return partner
+
+
+def test_ackmode_received(server):
+    partner = connect(server, "received")
+    with partner:
+        partner.sendall(b"abcdefgh")
+        # answered by the server without processing
+        assert receive(partner, 20) == b"Recieved  Recieved  "
+        assert server.buffer_recv.get(timeout=5) == b"abcd"
+        assert server.buffer_recv.get(timeout=5) == b"efgh"
+
+
+def test_ackmode_saved(server):
+    partner = connect(server, "saved")
+    with partner:
+        partner.sendall(b"abcd")
+        assert server.buffer_recv.get(timeout=5) == b"abcd"
+        server.channel.origin = server.channel.origins.popleft()
+        server.channel.acknowledge("decoded")
+        partner.settimeout(0.3)
+        with pytest.raises(socket.timeout):
+            partner.recv(20)
+        server.channel.acknowledge("saved", saved=True)
+        partner.settimeout(5)
+        assert partner.recv(20) == b"Saved     "
+
+
+def test_answer_of_closed_connection(server):
+    partner = connect(server, "saved")
+    with partner:
+        partner.sendall(b"abcd")
+        while server.buffer_recv.empty():
+            time.sleep(0.01)
+        # connection closed before the frame is answered (reading is paused until the answer)
+        for connection in list(server.connections):
+            server.loop.call_soon_threadsafe(connection.close)
+        while server.channel.connected:
+            time.sleep(0.01)
+    with socket.create_connection(("127.0.0.1", server.port), timeout=5) as partner:
+        wait_message(server, "Server waiting")
+        assert server.channel.frame_get() == b"abcd"
+        # the answer of the frame of the closed connection is not sent to the new partner
+        server.channel.acknowledge("saved", saved=True)
+        partner.sendall(b"efgh")
+        while server.buffer_recv.empty():
+            time.sleep(0.01)
+        assert server.channel.frame_get() == b"efgh"
+        server.channel.acknowledge("saved")
+        assert partner.recv(20) == b"Recieved  "
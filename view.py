@@ -17,6 +17,7 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 import os
+import collections
 import tkinter as tk
 import tkinter.ttk as ttk
 from tkinter import filedialog
@@ -58,6 +59,9 @@ class View(object):
         # set title
         self.window.title(self.controller.configfile["title"])
 
+        # close the csv files like "Exit" if the window is closed
+        self.window.protocol("WM_DELETE_WINDOW", self.controller.stop)
+
         # set icon
         self.window.iconphoto(True, self.img_icon)
 
@@ -224,6 +228,14 @@ class View(object):
         self.icon_led.create_image(0, 0, image=self.img_led_rd, anchor="nw")
         self.icon_led.create_image(0, 0, image=self.img_led_ye, anchor="nw")
 
+        # create label for number of received frames waiting for processing on infobar
+        self.queue_depth = tk.StringVar()
+        self.queue_depth.set("Queue: 0")
+        self.lbl_queue_depth = ttk.Label(master=self.infobar,
+                                         style="style_infobar.TLabel",
+                                         textvariable=self.queue_depth,
+                                         anchor="w")
+
         # create and place versionnumber and icon on infobar
         self.icon_version = tk.Canvas(master=self.infobar,
                                       relief="flat",
@@ -242,6 +254,9 @@ class View(object):
 
         # signal to rebuild table
         self.csv_table_rebuild = True
+        # entries of the table (oldest first) and maximum number of entries shown
+        self.csv_table_rows = collections.deque()
+        self.csv_table_maxrows = self.controller.configfile.get("csv_table_maxrows", 1000)
         # create and place treeview for data structure
         self.csv_table = ttk.Treeview(self.screen_home, style="Treeview")
         # add scrollbar to treeview
@@ -420,6 +435,23 @@ class View(object):
                                                  command=self.connect_show_recvdata,
                                                  style="style_screen.TCheckbutton")
 
+        # create label for answer mode
+        self.lbl_con_ackmode = ttk.Label(master=self.screen_server,
+                                         style="style_screen.TLabel",
+                                         text="Answer:",
+                                         anchor="w")
+
+        # create menu for answer mode (processing stage that is answered to the PLC)
+        self.con_ackmode = tk.StringVar()
+        self.con_ackmode.set(self.controller.projectfile.get("con_ackmode", "saved"))
+        self.con_ackchoices = ["saved", "decoded", "received", "none"]
+        self.men_con_ackmode = ttk.OptionMenu(self.screen_server,  # master=
+                                              self.con_ackmode,  # value=
+                                              "saved",  # default=
+                                              *self.con_ackchoices,  # values=
+                                              style="style_screen.TMenubutton",
+                                              command=lambda x: self.connect_ackmode())
+
         # screen data----------------------------------------------------------
         # create frame on screen data for udt name + description + version + info
         self.udt_infos = tk.Canvas(master=self.screen_data,
@@ -497,6 +529,15 @@ class View(object):
         self.datatree_scrolly = ttk.Scrollbar(self.screen_data, orient="vertical", command=self.datatree.yview)
         self.datatree.configure(xscrollcommand=self.datatree_scrollx.set)
         self.datatree.configure(yscrollcommand=self.datatree_scrolly.set)
+        # index of the element in datastructure for every entry in datatree {entry: index}
+        self.datatree_indexes = {}
+        # indexes of the elements that are visible in datatree
+        self.datatree_visible = set()
+        # subscribe the visible elements again when a folder is opened or closed or the screen changes
+        # treeview sends the events before the folder state changes
+        self.datatree.bind("<<TreeviewOpen>>", lambda x: self.window.after_idle(self.datatree_subscribe))
+        self.datatree.bind("<<TreeviewClose>>", lambda x: self.window.after_idle(self.datatree_subscribe))
+        self.screens.bind("<<NotebookTabChanged>>", lambda x: self.datatree_subscribe())
 
         # create button for datasructure import
         self.btn_import_datasructure = ttk.Button(master=self.screen_data,
@@ -633,7 +674,7 @@ class View(object):
         # create menu for triggermode
         self.csv_triggermode = tk.StringVar()
         self.csv_triggermode.set(self.controller.projectfile["csv_triggermode"])
-        self.csv_triggerchoices = ["boolean", "seconds", "minutes", "hours"]
+        self.csv_triggerchoices = ["boolean", "seconds", "minutes", "hours", "frame", "change"]
         self.men_csv_trigger = ttk.OptionMenu(self.screen_csv,  # master=
                                               self.csv_triggermode,  # value=
                                               "None",  # default=
@@ -780,6 +821,48 @@ class View(object):
                                               text="set Variable",
                                               style="style_screen.TButton",
                                               command=self.csv_rowvariable_set)
+
+        # create label for csv deadband of row (change mode)
+        self.lbl_csv_rowdeadband = ttk.Label(master=self.screen_csv,
+                                             style="style_screen.TLabel",
+                                             text="Deadband:",
+                                             anchor="w")
+
+        # create entry for csv deadband of row ("0.5" = absolute, "2%" = percent)
+        self.csv_rowdeadband = tk.StringVar()
+        self.csv_rowdeadband_name()
+        self.entry_csv_rowdeadband = ttk.Entry(master=self.screen_csv,
+                                               style="style_screen.TEntry",
+                                               textvariable=self.csv_rowdeadband,
+                                               justify="center")
+
+        # create button for set csv deadband of row
+        self.btn_csv_rowdeadband = ttk.Button(master=self.screen_csv,
+                                              takefocus=0,
+                                              text="set Deadband",
+                                              style="style_screen.TButton",
+                                              command=self.csv_rowdeadband_set)
+
+        # create label for csv timestamp
+        self.lbl_csv_timestamp = ttk.Label(master=self.screen_csv,
+                                           style="style_screen.TLabel",
+                                           text="Timestamp:",
+                                           anchor="w")
+
+        # create variable label for csv timestamp (DTL of the PLC or clock of the PC)
+        self.csv_timestamp = tk.StringVar()
+        self.csv_timestamp_name()
+        self.lbl_csv_timestamp_var = ttk.Label(master=self.screen_csv,
+                                               style="style_screen_var.TLabel",
+                                               textvariable=self.csv_timestamp,
+                                               anchor="center")
+
+        # create button for set csv timestamp
+        self.btn_csv_timestamp = ttk.Button(master=self.screen_csv,
+                                            takefocus=0,
+                                            text="set Timestamp",
+                                            style="style_screen.TButton",
+                                            command=self.csv_timestamp_set)
         # Key events-----------------------------------------------------------
         self.window.bind("<KeyPress>", self.keydown)
         self.window.bind("<KeyRelease>", self.keyup)
@@ -811,6 +894,7 @@ class View(object):
         self.lbl_timestamp.place(x=690 + ox, y=1, width=150, height=24)
         self.icon_led.place(x=246, y=3, width=20, height=20)
         self.lbl_led_connection.place(x=270, y=3, width=80, height=18)
+        self.lbl_queue_depth.place(x=360, y=3, width=300, height=18)
         self.icon_version.place(x=5, y=3, width=20, height=20)
         self.lbl_version.place(x=25, y=3, width=150, height=18)
         # scale gui elements from screen home----------------------------------
@@ -837,6 +921,8 @@ class View(object):
         self.cbx_autostart.place(x=180, y=91, width=80, height=40)
         self.lbl_show_recvdata.place(x=50, y=136, width=192, height=25)
         self.cbx_show_recvdata.place(x=245, y=129, width=21, height=40)
+        self.lbl_con_ackmode.place(x=50, y=175, width=80, height=25)
+        self.men_con_ackmode.place(x=135, y=175, width=95, height=25)
         # scale gui elements from screen data----------------------------------
         self.udt_infos.place(x=50, y=25, width=750 + ox, height=58)
         self.lbl_udt_name.place(x=0, y=0, width=50, height=25)
@@ -877,6 +963,12 @@ class View(object):
             self.lbl_csv_nexttrigger.place_forget()
             self.lbl_csv_booltrigger_var.place(x=240, y=157, width=195, height=25)
             self.btn_csv_booltrigger.place(x=445, y=157, width=100, height=25)
+        elif self.csv_triggermode.get() == "frame":
+            self.entry_csv_time.place_forget()
+            self.btn_csv_timeset.place_forget()
+            self.lbl_csv_nexttrigger.place_forget()
+            self.lbl_csv_booltrigger_var.place_forget()
+            self.btn_csv_booltrigger.place_forget()
         else:
             self.lbl_csv_booltrigger_var.place_forget()
             self.btn_csv_booltrigger.place_forget()
@@ -897,6 +989,17 @@ class View(object):
         self.lbl_csv_rowvariable.place(x=50, y=289, width=110, height=25)
         self.lbl_csv_rowvariable_var.place(x=170, y=289, width=265, height=25)
         self.btn_csv_rowvariable.place(x=445, y=289, width=100, height=25)
+        self.lbl_csv_timestamp.place(x=50, y=322, width=110, height=25)
+        self.lbl_csv_timestamp_var.place(x=170, y=322, width=265, height=25)
+        self.btn_csv_timestamp.place(x=445, y=322, width=100, height=25)
+        if self.csv_triggermode.get() == "change":
+            self.lbl_csv_rowdeadband.place(x=50, y=355, width=110, height=25)
+            self.entry_csv_rowdeadband.place(x=170, y=355, width=265, height=25)
+            self.btn_csv_rowdeadband.place(x=445, y=355, width=100, height=25)
+        else:
+            self.lbl_csv_rowdeadband.place_forget()
+            self.entry_csv_rowdeadband.place_forget()
+            self.btn_csv_rowdeadband.place_forget()
         if not self.controller.projectfile["opt_fullscreen"]:
             self.controller.projectfile["opt_windowwidth"] = self.window.winfo_width()
             self.controller.projectfile["opt_windowheight"] = self.window.winfo_height()
@@ -1102,6 +1205,8 @@ class View(object):
         """
         for element in self.datatree.get_children():
             self.datatree.delete(element)
+        self.datatree_indexes = {}
+        self.datatree_visible = set()
         self.udt_name.set("")
         self.udt_description.set("")
         self.udt_version.set("")
@@ -1118,7 +1223,8 @@ class View(object):
         self.udt_info.set(info)
         # check every element,
         folderpath = [""]
-        for element in data:
+        self.datatree_indexes = {}
+        for index, element in enumerate(data):
             # put actual data in datatree in the actual folder
             el_name = element["name"]
             el_datatype = element["datatype"]
@@ -1150,6 +1256,26 @@ class View(object):
                 folderpath.pop()
             # save element id in data
             element["variable"] = el_address
+            if el_address is not None:
+                self.datatree_indexes[el_address] = index
+        # subscribe the visible elements
+        self.datatree_subscribe()
+
+    def datatree_subscribe(self):
+        """
+        subscribe the elements that are visible in datatree (all folders above are open)
+        nothing is subscribed while screen data is not shown
+        """
+        indexes = []
+        if self.screens.select() == str(self.screen_data):
+            entries = list(self.datatree.get_children(""))
+            while entries:
+                entry = entries.pop()
+                indexes.append(self.datatree_indexes[entry])
+                if self.window.getboolean(self.datatree.item(entry, "open")):
+                    entries.extend(self.datatree.get_children(entry))
+        self.datatree_visible = set(indexes)
+        self.controller.decoder_subscribe("datatree", indexes)
 
     def datatree_update(self):
         """
@@ -1168,19 +1294,28 @@ class View(object):
         self.datatree_fill(name, description, version, info, data)
         self.udt_datasize.set(datasize)
 
-    def datatree_values_set(self):
+    def datatree_values_set(self, changed=None):
         """
         update value in datatree
+        if the indexes of the changed elements are given only these are updated
         """
         data = self.controller.projectfile["udt_datastructure"]
-        for element in data:
+        snapshot = self.controller.snapshot
+        # values of another datastructure are not shown
+        if snapshot is None or snapshot.datastructure is not data:
+            return
+        indexes = self.datatree_visible
+        if changed is not None:
+            indexes = indexes.intersection(changed)
+        for index in indexes:
+            element = data[index]
             # find the elements where "variable" is stored (elements that are shown in treeview)
             if element["variable"] is not None:
                 # get values from this entry in datatree
                 entry_data = self.datatree.item(element["variable"])
                 entry_values = entry_data["values"]
-                # update values
-                entry_values[1] = element["value"]
+                # update values (format the native value as text)
+                entry_values[1] = snapshot.text(index)
                 # save values
                 self.datatree.item(element["variable"], values=entry_values)
 
@@ -1192,6 +1327,7 @@ class View(object):
         self.csv_table_rebuild = True
         for element in self.csv_table.get_children():
             self.csv_table.delete(element)
+        self.csv_table_rows.clear()
         self.csv_table["columns"] = ""
         self.csv_table.column("#0", width=self.csv_table.winfo_width())
         self.csv_table.heading("#0", text="")
@@ -1203,15 +1339,18 @@ class View(object):
         if self.csv_table_rebuild:
             self.csv_table.column("#0", width=120, minwidth=50, stretch=tk.YES, anchor="center")
             self.csv_table.heading("#0", text="Time", anchor="center")
-            header.append("last")
-            self.csv_table["columns"] = header
+            # the header of the row is not changed (it can be queued for the csv writer)
+            self.csv_table["columns"] = header + ["last"]
             for col in self.csv_table["columns"]:
                 self.csv_table.column(col, width=100, minwidth=50, stretch=tk.YES, anchor="center")
                 self.csv_table.heading(col, text=col, anchor="center")
             self.csv_table.column("last", width=100, minwidth=100, stretch=tk.NO, anchor="center")
             self.csv_table.heading("last", text="", anchor="center")
             self.csv_table_rebuild = False
-        self.csv_table.insert("", "end", text=timestamp, values=data)
+        self.csv_table_rows.append(self.csv_table.insert("", "end", text=timestamp, values=data))
+        # show only the latest rows (every frame can be saved)
+        while len(self.csv_table_rows) > self.csv_table_maxrows:
+            self.csv_table.delete(self.csv_table_rows.popleft())
         self.csv_table_scroll()
 
     def csv_table_scroll(self):
@@ -1249,6 +1388,7 @@ class View(object):
         self.con_port.set(self.controller.projectfile["con_port"])
         self.con_autostart.set(self.controller.projectfile["con_autostart"])
         self.con_show_recvdata.set(self.controller.projectfile["con_show_recvdata"])
+        self.con_ackmode.set(self.controller.projectfile.get("con_ackmode", "saved"))
         self.csv_delimiter.set(self.controller.projectfile["csv_delimiter"])
 
     def setup_update(self):
@@ -1268,11 +1408,13 @@ class View(object):
         self.csv_triggermode.set(self.controller.projectfile["csv_triggermode"])
         self.csv_time.set(self.controller.projectfile["csv_time"])
         self.csv_trigger_name()
+        self.csv_timestamp_name()
         self.csv_rowdata = self.controller.projectfile["csv_rowdata"].copy()
         self.csv_row.set(1)
         self.csv_numrows.set(len(self.csv_rowdata))
         self.csv_rowname_name()
         self.csv_rowvariable_name()
+        self.csv_rowdeadband_name()
 
     def led_state(self, state="error"):
         """
@@ -1289,6 +1431,23 @@ class View(object):
                 self.icon_led.create_image(0, 0, image=self.img_led_rd, anchor="nw")
         self.icon_led_last_state = state
 
+    def queue_depth_set(self, depth, metrics=None):
+        """
+        show number of received frames waiting for processing
+        frames left after the processing cycle mean the processing is falling behind
+        show the rows waiting for the csv writer thread and its latency (if used)
+        """
+        if depth > 0:
+            text = "Queue: {depth} (behind)".format(depth=depth)
+        else:
+            text = "Queue: 0"
+        if metrics is not None:
+            text = "{text} | CSV: {depth} ({latency:.0f} ms)".format(text=text, depth=metrics["depth"],
+                                                                    latency=metrics["latency"] * 1000)
+            if metrics["dropped"] > 0:
+                text = "{text} {dropped} lost".format(text=text, dropped=metrics["dropped"])
+        self.queue_depth.set(text)
+
     def connect_autostart(self):
         """
         save content of checkbox after the state has changed
@@ -1301,6 +1460,12 @@ class View(object):
         """
         self.controller.projectfile["con_show_recvdata"] = self.con_show_recvdata.get()
 
+    def connect_ackmode(self):
+        """
+        save answer mode after it has changed (used with the next start of the server)
+        """
+        self.controller.projectfile["con_ackmode"] = self.con_ackmode.get()
+
     def connect_state(self):
         """
         toggle checkbutton
@@ -1371,6 +1536,7 @@ class View(object):
         self.csv_numrows.set(len(self.csv_rowdata))
         self.csv_rowname_name()
         self.csv_rowvariable_name()
+        self.csv_rowdeadband_name()
         self.csv_table_clear()
 
     def csv_actualrow_change(self, mode=""):
@@ -1395,6 +1561,7 @@ class View(object):
         self.csv_row.set(row)
         self.csv_rowname_name()
         self.csv_rowvariable_name()
+        self.csv_rowdeadband_name()
 
     def csv_trigger_set(self):
         """
@@ -1420,6 +1587,33 @@ class View(object):
             text = ""
         self.csv_booltrigger.set(text)
 
+    def csv_timestamp_set(self):
+        """
+        get selected DTL in Data and save its address in projectfile as timestamp of the csv rows
+        if no DTL is selected the clock of the PC is used
+        """
+        data = self.controller.projectfile["udt_datastructure"]
+        selected_id = self.datatree.focus()
+        selected_name = self.datatree.item(selected_id, "text")
+        self.controller.projectfile["csv_timestamp"] = 0
+        for element in data:
+            if element["name"] == selected_name and element["datatype"] == "DTL":
+                self.controller.projectfile["csv_timestamp"] = data.index(element)
+        self.csv_timestamp_name()
+        self.csv_table_clear()
+
+    def csv_timestamp_name(self):
+        """
+        read name of timestamp from datastructure and set the variable name of timestamp
+        """
+        data = self.controller.projectfile["udt_datastructure"]
+        index = self.controller.projectfile.get("csv_timestamp", 0)
+        if len(data) > 0 and index > 0:
+            text = data[index]["name"]
+        else:
+            text = "clock"
+        self.csv_timestamp.set(text)
+
     def csv_rowvariable_set(self):
         """
         get selected element in Data and save its address in projectfile
@@ -1428,7 +1622,7 @@ class View(object):
         selected_id = self.datatree.focus()
         selected_name = self.datatree.item(selected_id, "text")
         for element in data:
-            if element["name"] == selected_name and element["access"] is True:
+            if element["name"] == selected_name and (element["access"] is True or element["datatype"] == "DTL"):
                 self.csv_rowdata[self.csv_row.get() - 1]["Variable"] = data.index(element)
                 self.controller.projectfile["csv_rowdata"] = self.csv_rowdata.copy()
         self.csv_rowvariable_name()
@@ -1462,3 +1656,18 @@ class View(object):
         """
         self.csv_rowdata = self.controller.projectfile["csv_rowdata"].copy()
         self.csv_rowname.set(self.csv_rowdata[self.csv_row.get() - 1]["Text"])
+
+    def csv_rowdeadband_set(self):
+        """
+        get deadband from entry and save it in projectfile (change mode)
+        """
+        self.csv_rowdata[self.csv_row.get() - 1]["Deadband"] = self.csv_rowdeadband.get().strip()
+        self.controller.projectfile["csv_rowdata"] = self.csv_rowdata.copy()
+        self.csv_rowdeadband_name()
+
+    def csv_rowdeadband_name(self):
+        """
+        read deadband of the row from projectfile
+        """
+        self.csv_rowdata = self.controller.projectfile["csv_rowdata"].copy()
+        self.csv_rowdeadband.set(self.csv_rowdata[self.csv_row.get() - 1].get("Deadband", ""))